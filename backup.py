@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Online backups of the SQLite database.
+
+A backup is taken with SQLite's online backup API from its own read-only
+connection while the bot keeps running. Pages are copied a few at a time
+with a short sleep between steps, so the copy never holds a read
+transaction for long and leaves disk I/O for the bot; in WAL mode readers
+never block writers. A write from the bot restarts the copy, so if writes
+keep arriving faster than the steps finish, the rest is copied in a single
+step instead, from one consistent snapshot.
+
+Every backup is checked with PRAGMA integrity_check before it is gzipped
+into the backup directory, and only the newest BACKUP_KEEP are kept.
+
+Usage:
+    python backup.py create
+    python backup.py list
+    python backup.py verify BACKUP
+    python backup.py restore BACKUP
+
+Stop the bot before restoring. The replaced database is kept next to it.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Tables a usable MealsBot database must contain
+REQUIRED_TABLES = {'family_members', 'meal_responses', 'scheduler_state'}
+
+
+class BackupError(Exception):
+    """A backup could not be taken, verified or restored."""
+
+
+class BackupCancelled(BackupError):
+    """The backup was cancelled before it finished."""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _decompress(path: str, directory: str) -> str:
+    """Return a plain database file for a backup, unpacking .gz files into directory."""
+    if not path.endswith('.gz'):
+        return path
+    target = os.path.join(directory, 'restore.db')
+    with gzip.open(path, 'rb') as source, open(target, 'wb') as output:
+        shutil.copyfileobj(source, output, 1 << 20)
+    return target
+
+
+def check_database(path: str) -> Dict:
+    """Run integrity_check on a database file and count its members and responses."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        if result != 'ok':
+            raise BackupError(f"integrity check failed: {result}")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = REQUIRED_TABLES - tables
+        if missing:
+            raise BackupError(f"missing tables: {', '.join(sorted(missing))}")
+        return {
+            'members': conn.execute('SELECT COUNT(*) FROM family_members').fetchone()[0],
+            'responses': conn.execute('SELECT COUNT(*) FROM meal_responses').fetchone()[0],
+        }
+    except sqlite3.DatabaseError as e:
+        raise BackupError(str(e)) from e
+    finally:
+        conn.close()
+
+
+def verify(path: str) -> Dict:
+    """Check a (possibly gzipped) backup without touching the live database."""
+    with tempfile.TemporaryDirectory() as workdir:
+        return check_database(_decompress(path, workdir))
+
+
+def restore(path: str, database: str) -> Optional[str]:
+    """Verify a backup and put it in place of the database; returns where the old database was kept."""
+    directory = os.path.dirname(os.path.abspath(database))
+    # Unpack next to the database so the final rename stays on one filesystem
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        restored = _decompress(path, workdir)
+        check_database(restored)
+        if restored == path:
+            restored = shutil.copy(path, os.path.join(workdir, 'restore.db'))
+
+        kept = None
+        if os.path.exists(database):
+            # Fold the WAL into the old file first so the kept copy is complete
+            conn = sqlite3.connect(database)
+            try:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                conn.close()
+            kept = f"{database}.before-restore-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+            os.replace(database, kept)
+        # A leftover WAL would be replayed on top of the restored database
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+        os.replace(restored, database)
+    return kept
+
+
+class SQLiteBackup:
+    """Take, compress and rotate online backups of one SQLite database."""
+
+    def __init__(self, database: str, directory: str = 'backups', keep: int = 7, pages: int = 256,
+                 step_sleep: float = 0.05, max_restarts: int = 5):
+        self.database = database
+        self.directory = directory
+        self.keep = keep
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.max_restarts = max_restarts
+        self.prefix = os.path.splitext(os.path.basename(database))[0] + '-'
+        self._running = threading.Lock()
+        self._cancel = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._running.locked()
+
+    def cancel(self):
+        """Ask a running backup to stop after its current step."""
+        self._cancel.set()
+
+    def list(self) -> List[str]:
+        """Return the kept backups, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted((name for name in os.listdir(self.directory)
+                        if name.startswith(self.prefix) and name.endswith('.db.gz')), reverse=True)
+        return [os.path.join(self.directory, name) for name in names]
+
+    def rotate(self) -> List[str]:
+        """Delete all but the newest `keep` backups and return the deleted paths."""
+        removed = self.list()[self.keep:]
+        for path in removed:
+            os.remove(path)
+        return removed
+
+    def _copy(self, source: sqlite3.Connection, target: sqlite3.Connection) -> Dict:
+        stats = {'steps': 0, 'restarts': 0, 'single_step': False}
+        remaining_before = None
+
+        def progress(status, remaining, total):
+            nonlocal remaining_before
+            if self._cancel.is_set():
+                raise BackupCancelled("backup cancelled")
+            stats['steps'] += 1
+            # A write from another connection starts the copy over, so no pages are gained
+            if remaining_before is not None and remaining >= remaining_before:
+                stats['restarts'] += 1
+                if stats['restarts'] > self.max_restarts:
+                    raise _TooManyRestarts
+            remaining_before = remaining
+            # sqlite3 only sleeps between steps when a step is busy, so yield here
+            if remaining:
+                time.sleep(self.step_sleep)
+
+        try:
+            source.backup(target, pages=self.pages, progress=progress)
+        except _TooManyRestarts:
+            source.backup(target)
+            stats['single_step'] = True
+        return stats
+
+    def create(self) -> Dict:
+        """Back up, verify, compress and rotate; blocking, so run it in a thread."""
+        if not self._running.acquire(blocking=False):
+            raise BackupError("a backup is already running")
+        self._cancel.clear()
+        started = time.perf_counter()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{self.prefix}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz")
+            with tempfile.TemporaryDirectory(dir=self.directory) as workdir:
+                copy = os.path.join(workdir, 'backup.db')
+                source = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True, timeout=5.0)
+                target = sqlite3.connect(copy)
+                try:
+                    stats = self._copy(source, target)
+                finally:
+                    source.close()
+                    target.close()
+                counts = check_database(copy)
+
+                partial = os.path.join(workdir, 'backup.db.gz')
+                with open(copy, 'rb') as plain, gzip.open(partial, 'wb', compresslevel=6) as compressed:
+                    shutil.copyfileobj(plain, compressed, 1 << 20)
+                os.replace(partial, path)
+                database_bytes = os.path.getsize(copy)
+            removed = self.rotate()
+        finally:
+            self._running.release()
+
+        return {
+            'path': path,
+            'bytes': os.path.getsize(path),
+            'database_bytes': database_bytes,
+            'seconds': time.perf_counter() - started,
+            'rotated': len(removed),
+            **stats,
+            **counts,
+        }
+
+
+def main(argv: List[str]) -> int:
+    """Command line entry point; see the module docstring."""
+    load_dotenv()
+    database = os.getenv('DATABASE_PATH', 'meals_bot.db')
+    backups = SQLiteBackup(database, os.getenv('BACKUP_DIR', 'backups'), keep=int(os.getenv('BACKUP_KEEP', 7)))
+    command = argv[0] if argv else 'list'
+
+    try:
+        if command == 'create':
+            result = backups.create()
+            print(f"✅ {result['path']}: {result['members']} members, {result['responses']} responses, "
+                  f"{result['bytes'] / 1e6:.2f} MB ({result['database_bytes'] / 1e6:.2f} MB uncompressed) "
+                  f"in {result['seconds']:.1f}s")
+        elif command == 'list':
+            for path in backups.list():
+                print(f"{path}  {os.path.getsize(path) / 1e6:.2f} MB")
+        elif command == 'verify' and len(argv) == 2:
+            counts = verify(argv[1])
+            print(f"✅ {argv[1]} is intact: {counts['members']} members, {counts['responses']} responses")
+        elif command == 'restore' and len(argv) == 2:
+            kept = restore(argv[1], database)
+            print(f"✅ Restored {database} from {argv[1]}")
+            if kept:
+                print(f"   The previous database was kept as {kept}")
+        else:
+            print(__doc__)
+            return 2
+    except BackupError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
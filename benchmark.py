@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for MealsBot
+Compares storage backends on the operations the bot performs most often.
+
+Usage:
+    python benchmark.py [members] [backend ...]
+    python benchmark.py --footprint [members] [weeks]
+    python benchmark.py --trends [members] [weeks]
+    python benchmark.py --backup [members] [weeks] [toggle_ms]
+    python benchmark.py --broadcast [members]
+
+Backends: memory, sqlite, postgres (postgres needs DATABASE_URL and asyncpg).
+--footprint compares the memory used by survey state held as dicts with the
+compact bitmask representation in survey_state.py.
+--trends times the admin trends report over that much SQLite history: the
+bulk load, building the NumPy headcount cube and the vectorized analysis.
+--backup measures toggle latency on a SQLite database of that size with and
+without an online backup (backup.py) running at the same time.
+--broadcast compares loading the weekly survey's names and selections per
+recipient with the two batch queries the survey pre-warm uses.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import List
+
+from backup import SQLiteBackup
+from storage import InMemoryStorage, PostgresStorage, SQLiteStorage
+from survey_state import DAYS, MEAL_TYPES, MemberRecord, SurveyState
+from trends import HeadcountCube, week_range
+
+WEEK_START = '2024-01-01'
+
+
+def build_backend(name: str, workdir: str):
+    """Create a fresh backend instance by name."""
+    if name == 'memory':
+        return InMemoryStorage()
+    if name == 'sqlite':
+        return SQLiteStorage(os.path.join(workdir, 'benchmark.db'))
+    if name == 'postgres':
+        dsn = os.getenv('DATABASE_URL')
+        if not dsn:
+            return None
+        return PostgresStorage(dsn)
+    raise ValueError(f"Unknown backend: {name}")
+
+
+async def timed(label: str, count: int, coro_factory):
+    """Run coro_factory() count times and print throughput."""
+    start = time.perf_counter()
+    for i in range(count):
+        await coro_factory(i)
+    elapsed = time.perf_counter() - start
+    per_op = elapsed / count * 1e6 if count else 0
+    print(f"   {label:<24} {count:>7} ops  {elapsed * 1000:>9.1f} ms  {per_op:>8.1f} µs/op")
+    return elapsed
+
+
+async def benchmark_backend(storage, members: int):
+    """Run the standard workload against one backend."""
+    await storage.initialize()
+    try:
+        await timed("add_member", members, lambda i: storage.add_member(
+            i + 1, f"user{i}", f"User{i}", None, is_active=True))
+
+        cells = [(day, meal_type) for day in DAYS for meal_type in MEAL_TYPES]
+        toggles = members * len(cells)
+        await timed("toggle_response", toggles, lambda i: storage.toggle_response(
+            i // len(cells) + 1, WEEK_START, *cells[i % len(cells)]))
+        await timed("set_response (no-op)", toggles, lambda i: storage.set_response(
+            i // len(cells) + 1, WEEK_START, *cells[i % len(cells)], True))
+        await timed("get_responses", members, lambda i: storage.get_responses(i + 1, WEEK_START))
+        await timed("week_headcounts", 50, lambda i: storage.week_headcounts(WEEK_START))
+        await timed("week_responses", 10, lambda i: storage.week_responses(WEEK_START))
+    finally:
+        await storage.close()
+
+
+def measure(build) -> int:
+    """Return the bytes still allocated by the object build() returns."""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def benchmark_footprint(members: int, weeks: int):
+    """Compare memory per member-week for dict-based and compact survey state."""
+    cells = [(day, meal_type) for day in DAYS for meal_type in MEAL_TYPES]
+    week_starts = [f"2024-W{week:02d}" for week in range(weeks)]
+    rng = random.Random(42)
+    # Each member answers about two thirds of the cells and selects half of those
+    answers = [[(cell, rng.random() < 0.5) for cell in cells if rng.random() < 0.67]
+               for _ in range(members * weeks)]
+
+    def member_dicts():
+        return {user_id: {'user_id': user_id, 'username': f"user{user_id}", 'first_name': f"User{user_id}",
+                          'last_name': None, 'is_active': True, 'timezone': None, 'send_time': None}
+                for user_id in range(members)}
+
+    def string_keys():
+        # "{day}_{meal_type}" keys, as survey code used to build per user
+        return member_dicts(), {
+            (user_id, week): {f"{day}_{meal_type}": value for (day, meal_type), value in answers[i]}
+            for i, (user_id, week) in enumerate((u, w) for w in week_starts for u in range(members))
+        }
+
+    def tuple_keys():
+        # (day, meal_type) keys, one fresh tuple per row as read from the database
+        return member_dicts(), {
+            (user_id, week): {(day, meal_type): value for (day, meal_type), value in answers[i]}
+            for i, (user_id, week) in enumerate((u, w) for w in week_starts for u in range(members))
+        }
+
+    def compact():
+        state = SurveyState()
+        for user_id in range(members):
+            state.add_member(MemberRecord(user_id, f"user{user_id}", f"User{user_id}", None, True))
+        i = 0
+        for week in week_starts:
+            for user_id in range(members):
+                selected = [cell for cell, value in answers[i] if value]
+                unselected = [cell for cell, value in answers[i] if not value]
+                state.set(user_id, week, selected, True)
+                state.set(user_id, week, unselected, False)
+                i += 1
+        return state
+
+    member_weeks = members * weeks
+    print(f"🍽️ MealsBot Survey State Footprint ({members} members x {weeks} weeks = {member_weeks} member-weeks)\n")
+    print(f"   {'representation':<28} {'total':>10}  {'per member-week':>16}")
+    for label, build in [("dicts, string keys", string_keys), ("dicts, tuple keys", tuple_keys),
+                         ("slots + bitmask arrays", compact)]:
+        size = measure(build)
+        print(f"   {label:<28} {size / 1e6:>8.2f} MB  {size / member_weeks:>13.0f} B")
+
+
+async def populate_history(storage, members: int, weeks: int) -> List[str]:
+    """Give every member about half the meals selected in each of `weeks` weeks; returns the week starts."""
+    cells = [(day, meal_type) for day in DAYS for meal_type in MEAL_TYPES]
+    week_starts = week_range(WEEK_START, (date.fromisoformat(WEEK_START) + timedelta(weeks=weeks - 1)).isoformat())
+    rng = random.Random(42)
+    for user_id in range(members):
+        await storage.add_member(user_id, None, f"User{user_id}", None, is_active=True)
+    for week_start in week_starts:
+        for user_id in range(members):
+            await storage.set_responses(user_id, week_start, [c for c in cells if rng.random() < 0.5], True)
+    return week_starts
+
+
+async def benchmark_trends(members: int, weeks: int):
+    """Time the trends report over weeks of SQLite history."""
+    print(f"🍽️ MealsBot Trends Report ({members} members x {weeks} weeks)\n")
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = SQLiteStorage(os.path.join(workdir, 'benchmark.db'))
+        await storage.initialize()
+        week_starts = await populate_history(storage, members, weeks)
+
+        started = time.perf_counter()
+        rows = await storage.responses_between(week_starts[0], week_starts[-1])
+        loaded = time.perf_counter()
+        cube = HeadcountCube.from_rows(week_starts, list(range(members)), rows)
+        built = time.perf_counter()
+        cube.rolling_mean(4)
+        cube.forecast()
+        cube.attendance()
+        analysed = time.perf_counter()
+        await storage.close()
+
+    print(f"   {len(rows)} responses")
+    print(f"   {'load rows':<20} {(loaded - started) * 1000:8.1f} ms")
+    print(f"   {'build cube':<20} {(built - loaded) * 1000:8.1f} ms")
+    print(f"   {'analyse':<20} {(analysed - built) * 1000:8.1f} ms")
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def benchmark_backup(members: int, weeks: int, interval: float = 0.01):
+    """Compare toggle latency with and without a concurrent online backup."""
+    cells = [(day, meal_type) for day in DAYS for meal_type in MEAL_TYPES]
+    rng = random.Random(7)
+
+    async def toggle_latencies(until) -> List[float]:
+        # One toggle every `interval` seconds, like a busy Monday morning
+        latencies = []
+        while not until():
+            user_id = rng.randrange(members)
+            started = time.perf_counter()
+            await storage.toggle_response(user_id, WEEK_START, *rng.choice(cells))
+            latencies.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(interval)
+        return latencies
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, 'benchmark.db')
+        storage = SQLiteStorage(database)
+        await storage.initialize()
+        await populate_history(storage, members, weeks)
+        backups = SQLiteBackup(database, os.path.join(workdir, 'backups'))
+        print(f"🍽️ MealsBot Backup Impact ({members} members x {weeks} weeks, "
+              f"{os.path.getsize(database) / 1e6:.1f} MB, one toggle every {interval * 1000:.0f} ms)\n")
+
+        backup = asyncio.ensure_future(asyncio.to_thread(backups.create))
+        during = await toggle_latencies(backup.done)
+        result = await backup
+        stop_at = time.perf_counter() + result['seconds']
+        baseline = await toggle_latencies(lambda: time.perf_counter() >= stop_at)
+        await storage.close()
+
+    print(f"   {'':<16} {'toggles':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for label, samples in [("no backup", baseline), ("during backup", during)]:
+        print(f"   {label:<16} {len(samples):>8} {percentile(samples, 0.5):>8.2f} "
+              f"{percentile(samples, 0.99):>8.2f} {max(samples):>8.2f}")
+    print(f"\n   Backup: {result['seconds']:.2f}s, {result['steps']} steps, {result['restarts']} restarts"
+          f"{', finished in a single step' if result['single_step'] else ''}, "
+          f"{result['database_bytes'] / 1e6:.1f} MB -> {result['bytes'] / 1e6:.1f} MB gzipped")
+
+
+async def benchmark_broadcast(members: int):
+    """Compare per-recipient survey lookups with the pre-warm's two batch queries on SQLite."""
+    print(f"🍽️ MealsBot Survey Broadcast Loads ({members} members)\n")
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = SQLiteStorage(os.path.join(workdir, 'benchmark.db'))
+        await storage.initialize()
+        await populate_history(storage, members, 1)
+
+        started = time.perf_counter()
+        for member in await storage.list_members(is_active=True):
+            await storage.get_first_name(member['user_id'])
+            await storage.get_responses(member['user_id'], WEEK_START)
+        per_recipient = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await storage.list_members(is_active=True)
+        await storage.week_responses(WEEK_START)
+        batch = time.perf_counter() - started
+        await storage.close()
+
+    print(f"   {'per recipient':<16} {2 * members + 1:>7} queries  {per_recipient * 1000:>8.1f} ms")
+    print(f"   {'batch':<16} {2:>7} queries  {batch * 1000:>8.1f} ms")
+
+
+async def main():
+    """Run the benchmark for each requested backend."""
+    if sys.argv[1:2] == ['--footprint']:
+        members = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        weeks = int(sys.argv[3]) if len(sys.argv) > 3 else 26
+        benchmark_footprint(members, weeks)
+        return
+    if sys.argv[1:2] == ['--trends']:
+        members = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+        weeks = int(sys.argv[3]) if len(sys.argv) > 3 else 156
+        await benchmark_trends(members, weeks)
+        return
+    if sys.argv[1:2] == ['--backup']:
+        members = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        weeks = int(sys.argv[3]) if len(sys.argv) > 3 else 156
+        interval = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.01
+        await benchmark_backup(members, weeks, interval)
+        return
+    if sys.argv[1:2] == ['--broadcast']:
+        await benchmark_broadcast(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+        return
+
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    backends = sys.argv[2:] or ['memory', 'sqlite', 'postgres']
+
+    print(f"🍽️ MealsBot Storage Benchmark ({members} members)\n")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in backends:
+            storage = build_backend(name, workdir)
+            print(f"{'='*50}\nBackend: {name}\n{'='*50}")
+            if storage is None:
+                print("   ⚠️ Skipped (set DATABASE_URL to benchmark PostgreSQL)")
+                continue
+            try:
+                await benchmark_backend(storage, members)
+            except Exception as e:
+                print(f"   ❌ Failed: {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Per-user ordering for concurrently processed updates.
+
+With concurrent updates enabled PTB starts a task per update, so a slow
+handler no longer delays other users. Updates from the same user are still
+processed one at a time and in arrival order: while one of a user's updates
+is being handled, the user's later updates wait in a short per-user queue
+and are handled by the same task once it finishes.
+
+PTB holds one of its CONCURRENT_UPDATES slots for as long as an update is
+being processed, so queued updates must not wait inside a slot of their own:
+a user tapping quickly would otherwise take every slot and stall everyone
+else. A queued update returns at once, each busy user holds at most one
+slot, and updates beyond the queue's depth are dropped.
+"""
+
+import logging
+from collections import deque
+from typing import Deque, Dict
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+
+class UserOrderedApplication(Application):
+    """Application that serializes updates per user while processing users concurrently."""
+
+    def __init__(self, max_pending_per_user: int = 8, **kwargs):
+        super().__init__(**kwargs)
+        self.max_pending_per_user = max_pending_per_user
+        self._pending: Dict[int, Deque[Update]] = {}
+
+    @property
+    def busy_users(self) -> int:
+        return len(self._pending)
+
+    async def process_update(self, update: object) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await super().process_update(update)
+            return
+
+        # Checked and claimed before the first await so arrival order is kept
+        pending = self._pending.get(user.id)
+        if pending is not None:
+            if len(pending) >= self.max_pending_per_user:
+                await self.shed_update(update)
+            else:
+                pending.append(update)
+            return
+
+        pending = self._pending[user.id] = deque()
+        try:
+            while True:
+                try:
+                    await super().process_update(update)
+                except Exception as e:
+                    logger.error("Failed to process update %s: %s", update.update_id, e)
+                if not pending:
+                    break
+                update = pending.popleft()
+        finally:
+            del self._pending[user.id]
+
+    async def shed_update(self, update: Update):
+        """Drop an update from a user who already has a full queue."""
+        logger.warning("Dropping update %s: user %s has %s updates queued", update.update_id,
+                       update.effective_user.id, self.max_pending_per_user,
+                       extra={'event': 'update_shed', 'user_id': update.effective_user.id})
+        if update.callback_query:
+            try:
+                await update.callback_query.answer("⏳ Slow down! Please wait a moment before tapping again.")
+            except Exception as e:
+                logger.debug("Couldn't answer shed callback %s: %s", update.callback_query.id, e)
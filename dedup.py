@@ -0,0 +1,97 @@
+"""
+Duplicate update detection for MealsBot.
+
+Telegram may redeliver updates (e.g. after a restart before the offset was
+confirmed). UpdateDeduplicator remembers recently seen update ids in a
+bounded LRU set and keeps a persisted high-water mark of handled update ids.
+
+The mark only advances once an update has been handled, and never past an
+update that is still being handled, so a crash mid-update doesn't cause it
+to be dropped when Telegram redelivers it. Only ids in a window just below
+the mark count as redeliveries: Telegram may restart update ids at a lower
+value after a week without updates, and those must not all be dropped.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Set
+
+HIGH_WATER_MARK_KEY = 'last_update_id'
+
+
+class RecentIds:
+    """A bounded set that forgets the least recently seen ids first."""
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._ids: OrderedDict = OrderedDict()
+
+    def seen(self, item: Hashable) -> bool:
+        """Record an id and return True if it was already present."""
+        if item in self._ids:
+            self._ids.move_to_end(item)
+            return True
+        self._ids[item] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class UpdateDeduplicator:
+    """Drop updates that have already been handled."""
+
+    def __init__(self, max_size: int = 1000, window: int = 1000, save_interval: float = 5.0):
+        self.update_ids = RecentIds(max_size)
+        self.window = window
+        self.high_water_mark = 0
+        self.save_interval = save_interval
+        self._saved_mark = 0
+        self._loaded_mark = 0
+        self._last_save = 0.0
+        self._in_flight: Set[int] = set()
+
+    async def load(self, storage):
+        """Restore the high-water mark persisted by a previous run."""
+        value = await storage.get_state(HIGH_WATER_MARK_KEY)
+        self.high_water_mark = self._saved_mark = self._loaded_mark = int(value) if value else 0
+
+    def safe_mark(self) -> int:
+        """The highest handled update id with no update at or below it still being handled."""
+        if self._in_flight:
+            return min(self.high_water_mark, min(self._in_flight) - 1)
+        return self.high_water_mark
+
+    async def save(self, storage, force: bool = False):
+        """Persist the high-water mark, at most once per save_interval unless forced."""
+        mark = self.safe_mark()
+        if mark == self._saved_mark:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_save < self.save_interval:
+            return
+        await storage.set_state(HIGH_WATER_MARK_KEY, str(mark))
+        self._saved_mark = mark
+        self._last_save = now
+
+    def is_duplicate(self, update_id: Optional[int]) -> bool:
+        """Return True if the update was already handled; otherwise track it as being handled."""
+        if update_id is None:
+            return False
+        # Within a run the LRU is authoritative; the mark loaded at startup
+        # catches redeliveries of updates handled before a restart
+        if self.update_ids.seen(update_id) or self._loaded_mark - self.window < update_id <= self._loaded_mark:
+            return True
+        self._in_flight.add(update_id)
+        return False
+
+    def mark_processed(self, update_id: Optional[int]):
+        """Record that an accepted update has been handled."""
+        if update_id is None:
+            return
+        self._in_flight.discard(update_id)
+        if update_id > self.high_water_mark or update_id <= self.high_water_mark - self.window:
+            # A much lower id means Telegram restarted its update ids
+            self.high_water_mark = update_id
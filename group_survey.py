@@ -0,0 +1,147 @@
+"""
+Shared weekly survey message for the family group chat.
+
+Instead of one private survey per member, a single message is posted to
+FAMILY_CHAT_ID. Every member taps it to add or remove themselves from a
+meal; selections are stored per user as usual and the buttons show live
+headcounts, read from the live counters. Taps only mark the message dirty:
+edits are debounced so a burst of taps costs one edit, which also keeps the
+bot under Telegram's limit of about 20 messages per minute in a group.
+
+The buttons are shared, so they can't carry each member's target value the
+way private survey buttons do. Instead every render gets a token that goes
+into the callback data. A member's first tap on a meal under a token picks
+the value (the opposite of their selection at that moment), and later taps
+on that meal under the same token set the same value again. So a double tap
+is a no-op; tapping again after the message updates flips the meal back.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+MessageKey = Tuple[int, int]
+# (render token, user_id, day, meal_type)
+TapKey = Tuple[str, int, str, str]
+
+
+class GroupSurvey:
+    """Post, update and re-render the shared survey message for a week."""
+
+    def __init__(self, chat_id: int, storage, days: List[str], meal_types: List[str], debounce: float = 3.0):
+        self.chat_id = chat_id
+        self.storage = storage
+        self.days = days
+        self.meal_types = meal_types
+        self.debounce = debounce
+        self._pending: Dict[MessageKey, Tuple[asyncio.Task, str]] = {}
+        self._taps: OrderedDict = OrderedDict()
+        self._max_taps = 10000
+        # Tokens stay unique across restarts without persisting a counter
+        self._tokens = itertools.count(int(time.time()))
+
+    @staticmethod
+    def state_key(week_start: str) -> str:
+        return f"group_survey:{week_start}"
+
+    async def posted_message(self, week_start: str) -> Optional[int]:
+        """Return the id of the survey message posted for a week, if any."""
+        message_id = await self.storage.get_state(self.state_key(week_start))
+        return int(message_id) if message_id else None
+
+    def render(self, week_start: str, headcounts: Dict) -> Tuple[str, InlineKeyboardMarkup]:
+        """Build the message text and headcount keyboard from a week's live headcounts."""
+        token = format(next(self._tokens), 'x')
+        text = (
+            f"🍽️ **Family Meal Survey - Week of {week_start}**\n\n"
+            "Tap a meal to add or remove yourself. The numbers show how many people need each meal.\n"
+            "Use 'My Selection' to check your own choices.\n\n"
+            f"👥 **Meals needed this week:** {sum(headcounts.values())}"
+        )
+
+        keyboard = []
+        for day in self.days:
+            row = [InlineKeyboardButton(f"📅 {day}", callback_data="day_header")]
+            for meal_type in self.meal_types:
+                count = headcounts.get((day, meal_type), 0)
+                row.append(InlineKeyboardButton(
+                    f"{meal_type.title()[:3]} {count}",
+                    callback_data=f"gmeal_{week_start}_{day.lower()}_{meal_type}_{token}"
+                ))
+            keyboard.append(row)
+        keyboard.append([InlineKeyboardButton("👀 My Selection", callback_data=f"gmine_{week_start}")])
+        return text, InlineKeyboardMarkup(keyboard)
+
+    def tap_target(self, token: str, user_id: int, day: str, meal_type: str, selected: bool) -> bool:
+        """Return the value a tap sets: the same for every tap by a member on a meal under one render."""
+        key: TapKey = (token, user_id, day, meal_type)
+        target = self._taps.get(key)
+        if target is None:
+            target = self._taps[key] = not selected
+            if len(self._taps) > self._max_taps:
+                self._taps.popitem(last=False)
+        return target
+
+    def selection_summary(self, responses: Dict) -> str:
+        """Short per-day summary of one member's selections, for a callback alert."""
+        lines = []
+        for day in self.days:
+            meals = [meal_type.title() for meal_type in self.meal_types if responses.get((day, meal_type))]
+            if meals:
+                lines.append(f"{day[:3]}: {', '.join(meals)}")
+        return "\n".join(lines) if lines else "You haven't selected any meals yet."
+
+    async def post(self, bot, week_start: str) -> int:
+        """Post the survey for a week to the group and remember its message id."""
+        text, reply_markup = self.render(week_start, await self.storage.week_headcounts(week_start))
+        message = await bot.send_message(chat_id=self.chat_id, text=text, reply_markup=reply_markup)
+        await self.storage.set_state(self.state_key(week_start), str(message.message_id))
+        return message.message_id
+
+    def request_refresh(self, bot, chat_id: int, message_id: int, week_start: str):
+        """Schedule a debounced re-render; taps before it runs are folded into one edit."""
+        key = (chat_id, message_id)
+        if key in self._pending:
+            return
+        task = asyncio.create_task(self._refresh_later(bot, key, week_start))
+        self._pending[key] = (task, week_start)
+
+    async def _refresh_later(self, bot, key: MessageKey, week_start: str):
+        await asyncio.sleep(self.debounce)
+        # Taps from here on schedule another refresh rather than being lost
+        self._pending.pop(key, None)
+        await self.refresh(bot, key, week_start)
+
+    async def refresh(self, bot, key: MessageKey, week_start: str):
+        """Edit the message to show the current headcounts."""
+        chat_id, message_id = key
+        text, reply_markup = self.render(week_start, await self.storage.week_headcounts(week_start))
+        try:
+            await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id,
+                                        reply_markup=reply_markup)
+        except RetryAfter as e:
+            logger.warning("Group survey edit rate limited, retrying in %ss", e.retry_after)
+            await asyncio.sleep(float(e.retry_after))
+            self.request_refresh(bot, chat_id, message_id, week_start)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.error("Failed to update group survey %s: %s", message_id, e)
+        except Exception as e:
+            logger.error("Failed to update group survey %s: %s", message_id, e)
+
+    async def flush(self, bot):
+        """Apply pending edits now instead of after the debounce delay."""
+        pending, self._pending = self._pending, {}
+        for task, _ in pending.values():
+            task.cancel()
+        await asyncio.gather(*(task for task, _ in pending.values()), return_exceptions=True)
+        for key, (_, week_start) in pending.items():
+            await self.refresh(bot, key, week_start)
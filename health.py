@@ -0,0 +1,221 @@
+"""
+Health checks for MealsBot.
+
+A monitor task on the bot's event loop samples event-loop lag, runs a
+timed probe query against the database and reads the outbox depth. The
+Flask thread turns the latest measurements into liveness and readiness
+responses, so the endpoints keep answering (and report the loop as
+blocked) even when the event loop itself is stuck.
+
+Every check has a (degraded, unhealthy) threshold pair. Liveness fails
+only when something is unhealthy, so the platform restarts the instance;
+readiness also fails when degraded, so traffic can be shed first. Until
+polling has started (within a startup grace period) the bot reports
+"starting": live, but not yet ready.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+UNHEALTHY = 'unhealthy'
+STARTING = 'starting'
+STOPPING = 'stopping'
+
+_SEVERITY = {HEALTHY: 0, STARTING: 1, DEGRADED: 2, UNHEALTHY: 3}
+
+Thresholds = Tuple[Optional[float], Optional[float]]
+
+DEFAULT_THRESHOLDS: Dict[str, Thresholds] = {
+    'event_loop_lag_ms': (250.0, 2000.0),
+    'db_probe_ms': (500.0, 3000.0),
+    'last_update_age_s': (None, None),
+    'outbox_depth': (500.0, 5000.0),
+}
+
+
+def parse_thresholds(value: str) -> Thresholds:
+    """Parse "degraded,unhealthy"; an empty part disables that level."""
+    degraded, _, unhealthy = value.partition(',')
+    return (float(degraded) if degraded.strip() else None,
+            float(unhealthy) if unhealthy.strip() else None)
+
+
+def classify(value: Optional[float], thresholds: Thresholds) -> str:
+    """Return the status of a measurement against its thresholds."""
+    if value is None:
+        return HEALTHY
+    degraded, unhealthy = thresholds
+    if unhealthy is not None and value >= unhealthy:
+        return UNHEALTHY
+    if degraded is not None and value >= degraded:
+        return DEGRADED
+    return HEALTHY
+
+
+class HealthMonitor:
+    """Measure the bot's health on its event loop and report it from any thread."""
+
+    def __init__(self, storage, thresholds: Optional[Dict[str, Thresholds]] = None,
+                 interval: float = 10.0, tick: float = 0.5, probe_timeout: float = 5.0,
+                 polling: Optional[Callable[[], bool]] = None, startup_grace: float = 120.0):
+        self.storage = storage
+        self.thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+        self.interval = interval
+        self.tick = tick
+        self.probe_timeout = probe_timeout
+        self.polling = polling
+        self.startup_grace = startup_grace
+        self.polling_started = False
+        self.started_at: Optional[float] = None
+        self.stopping = False
+        self.last_tick: Optional[float] = None
+        self.last_update_at: Optional[float] = None
+        self.loop_lag_ms = 0.0
+        self.db_probe_ms: Optional[float] = None
+        self.db_error: Optional[str] = None
+        self.outbox_depth: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_update_processed(self):
+        """Record that an update was handled."""
+        self.last_update_at = time.monotonic()
+
+    def start(self):
+        """Start sampling on the running event loop."""
+        self.started_at = self.last_tick = time.monotonic()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop sampling and report the bot as stopping so it is taken out of rotation."""
+        self.stopping = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """Sample loop lag every tick and run the slower checks every interval."""
+        window_lag = 0.0
+        next_check = 0.0
+        while True:
+            expected = time.monotonic() + self.tick
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            self.last_tick = now
+            window_lag = max(window_lag, now - expected)
+            if now < next_check:
+                continue
+            self.loop_lag_ms = window_lag * 1000
+            window_lag = 0.0
+            next_check = now + self.interval
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Health check failed: %s", e)
+
+    async def check(self):
+        """Time a database probe and read the outbox depth."""
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.storage.probe(), timeout=self.probe_timeout)
+            self.db_error = None
+        except asyncio.TimeoutError:
+            self.db_error = f"probe timed out after {self.probe_timeout:.0f}s"
+        except Exception as e:
+            self.db_error = str(e)
+        self.db_probe_ms = (time.perf_counter() - started) * 1000
+        if self.db_error:
+            logger.warning("Database probe failed: %s", self.db_error,
+                           extra={'event': 'health_probe_failed', 'probe_ms': round(self.db_probe_ms, 1)})
+            return
+        self.outbox_depth = await self.storage.outbox_depth()
+
+    def report(self) -> Dict:
+        """Classify the latest measurements; safe to call from another thread."""
+        if self.stopping:
+            return {'status': STOPPING, 'checks': {}}
+        if self.started_at is None:
+            return {'status': STARTING, 'checks': {}}
+
+        now = time.monotonic()
+        # A blocked loop stops ticking, so count the time since the last tick as lag
+        stalled_ms = max(0.0, now - self.last_tick - self.tick) * 1000
+        last_update_age = now - (self.last_update_at or self.started_at)
+        values = {
+            'event_loop_lag_ms': round(max(self.loop_lag_ms, stalled_ms), 1),
+            'db_probe_ms': None if self.db_probe_ms is None else round(self.db_probe_ms, 1),
+            'last_update_age_s': round(last_update_age, 1),
+            'outbox_depth': self.outbox_depth,
+        }
+
+        checks = {}
+        for name, value in values.items():
+            degraded, unhealthy = self.thresholds[name]
+            checks[name] = {
+                'value': value,
+                'status': classify(value, self.thresholds[name]),
+                'degraded_at': degraded,
+                'unhealthy_at': unhealthy,
+            }
+        if self.db_error:
+            checks['db_probe_ms'].update(status=UNHEALTHY, error=self.db_error)
+        if self.polling is not None:
+            polling = self.polling()
+            self.polling_started = self.polling_started or polling
+            if polling:
+                polling_status = HEALTHY
+            elif not self.polling_started and now - self.started_at < self.startup_grace:
+                # Startup work runs before polling begins
+                polling_status = STARTING
+            else:
+                polling_status = UNHEALTHY
+            checks['polling'] = {'value': polling, 'status': polling_status}
+
+        status = max((check['status'] for check in checks.values()), key=_SEVERITY.get, default=HEALTHY)
+        return {'status': status, 'checks': checks}
+
+
+def thresholds_from_env() -> Dict[str, Thresholds]:
+    """Read threshold overrides such as HEALTH_EVENT_LOOP_LAG_MS="250,2000"."""
+    thresholds = {}
+    for name in DEFAULT_THRESHOLDS:
+        value = os.getenv(f'HEALTH_{name.upper()}')
+        if value is not None:
+            thresholds[name] = parse_thresholds(value)
+    return thresholds
+
+
+def register_health_routes(app: Flask, monitor: HealthMonitor):
+    """Expose liveness, readiness and a detailed report on the Flask app."""
+
+    @app.route('/health/live')
+    def health_live():
+        report = monitor.report()
+        code = 503 if report['status'] == UNHEALTHY else 200
+        return {'status': report['status']}, code
+
+    @app.route('/health/ready')
+    def health_ready():
+        report = monitor.report()
+        code = 200 if report['status'] == HEALTHY else 503
+        return {'status': report['status']}, code
+
+    @app.route('/health')
+    def health():
+        report = monitor.report()
+        code = 503 if report['status'] == UNHEALTHY else 200
+        return {'bot': 'MealsBot', **report}, code
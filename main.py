@@ -1,24 +1,42 @@
+import asyncio
 import logging
 import os
-import sqlite3
+import random
 import schedule
+import tempfile
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram.error import BadRequest
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, ContextTypes, TypeHandler
+)
 from dotenv import load_dotenv
 from flask import Flask
 
+from backup import BackupCancelled, SQLiteBackup
+from concurrency import UserOrderedApplication
+from dedup import UpdateDeduplicator
+from group_survey import GroupSurvey
+from health import HealthMonitor, register_health_routes, thresholds_from_env
+from outbox import Outbox
+from profiling import LiveProfiler
+from log_setup import configure_logging
+from ratelimit import CallbackThrottle
+from storage import create_storage
+from survey_state import DAYS, MEAL_TYPES
+from tracing import TracedApplication, TracedRequest, TracedStorage, create_tracer
+from trends import HeadcountCube, week_range
+
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Configure logging (JSON lines written off the event loop, see log_setup.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Create Flask app for health checks
@@ -28,56 +46,155 @@ app = Flask(__name__)
 def health_check():
     return "MealsBot is running!", 200
 
-@app.route('/health')
-def health():
-    return {"status": "healthy", "bot": "MealsBot"}, 200
-
-# Database setup
-def init_database():
-    """Initialize the SQLite database with required tables."""
-    conn = sqlite3.connect('meals_bot.db')
-    cursor = conn.cursor()
-    
-    # Create family members table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS family_members (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-    
-    # Create meal responses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS meal_responses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            week_start DATE,
-            meal_type TEXT,
-            day TEXT,
-            response BOOLEAN,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES family_members (user_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+class MealsApplication(UserOrderedApplication, TracedApplication):
+    """Processes users' updates concurrently, in order per user, each inside its own trace."""
 
 class MealsBot:
     def __init__(self):
         self.bot_token = os.getenv('BOT_TOKEN')
         self.admin_user_id = int(os.getenv('ADMIN_USER_ID', 0))
         self.application = None
-        self.meal_types = ['breakfast', 'lunch', 'dinner']
-        self.days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        self.loop = None
+        self.tracer = create_tracer()
+        self.storage = TracedStorage(create_storage(), self.tracer)
+        self.deduplicator = UpdateDeduplicator()
+        self.outbox = Outbox(self.storage, tracer=self.tracer)
+        self.health = HealthMonitor(
+            self.storage,
+            thresholds_from_env(),
+            interval=float(os.getenv('HEALTH_CHECK_INTERVAL', 10)),
+            polling=self.is_polling,
+            startup_grace=float(os.getenv('HEALTH_STARTUP_GRACE_S', 120))
+        )
+        self.pending_selection = set()
+        self.report_cache: Dict[tuple, tuple] = {}
+        self.trend_history_weeks = int(os.getenv('TREND_HISTORY_WEEKS', 52))
+        self.trend_window = int(os.getenv('TREND_WINDOW', 4))
+        self.profiler = LiveProfiler(max_seconds=int(os.getenv('PROFILE_MAX_SECONDS', 300)))
+        self.callback_throttle = CallbackThrottle(
+            rate=float(os.getenv('CALLBACK_RATE', 3)),
+            burst=float(os.getenv('CALLBACK_BURST', 8)),
+            max_in_flight=int(os.getenv('MAX_IN_FLIGHT_CALLBACKS', 50)),
+            priority_reserved=int(os.getenv('ADMIN_RESERVED_CALLBACKS', 10))
+        )
+        self.meal_types = list(MEAL_TYPES)
+        self.days = list(DAYS)
+        # Post one shared survey to the family group instead of one per member
+        family_chat_id = os.getenv('FAMILY_CHAT_ID')
+        self.group_survey = GroupSurvey(
+            int(family_chat_id), self.storage, self.days, self.meal_types,
+            debounce=float(os.getenv('GROUP_SURVEY_DEBOUNCE', 3))
+        ) if family_chat_id else None
+        self.default_timezone = os.getenv('DEFAULT_TIMEZONE')
+        self.default_send_time = os.getenv('DEFAULT_SEND_TIME', '09:00')
+        self.survey_spread_minutes = int(os.getenv('SURVEY_SPREAD_MINUTES', 60))
+        # Render weekly surveys this long before their slot so sending them is only network I/O
+        self.survey_prewarm_minutes = int(os.getenv('SURVEY_PREWARM_MINUTES', 30))
+        self.timezones: Dict[int, Optional[str]] = {}
+        self.queued_surveys = set()
+        self.shutdown_timeout = float(os.getenv('SHUTDOWN_TIMEOUT', 20))
+        # Online backups of the SQLite database file
+        database_path = getattr(self.storage, 'path', None)
+        self.backups = SQLiteBackup(
+            database_path,
+            os.getenv('BACKUP_DIR', 'backups'),
+            keep=int(os.getenv('BACKUP_KEEP', 7)),
+            pages=int(os.getenv('BACKUP_PAGES', 256)),
+            step_sleep=float(os.getenv('BACKUP_STEP_SLEEP', 0.05))
+        ) if self.storage.name == 'sqlite' and database_path != ':memory:' else None
+        self.backup_time = os.getenv('BACKUP_TIME', '03:00')
+        self.reconcile_minutes = int(os.getenv('HEADCOUNT_RECONCILE_MINUTES', 60))
+        self.reconcile_weeks = int(os.getenv('HEADCOUNT_RECONCILE_WEEKS', 4))
+        self.stopping = False
+        self.broadcast_lock = asyncio.Lock()
+        self.background_tasks = set()
+        self.scheduler_stop = threading.Event()
         
         if not self.bot_token:
             raise ValueError("BOT_TOKEN not found in environment variables")
+    
+    async def post_init(self, application: Application):
+        """Open storage and start the scheduler once the event loop is running."""
+        await self.storage.initialize()
+        logger.info("Using %s storage backend", self.storage.name)
+        await self.deduplicator.load(self.storage)
+        # Check every week's counters once at startup; the periodic check covers recent weeks
+        await self.reconcile_headcounts(since_week='')
+        self.outbox.start(application.bot)
+        self.health.start()
+        self.loop = asyncio.get_running_loop()
+        self.schedule_weekly_surveys()
+        self.schedule_backups()
+        self.schedule_headcount_reconciliation()
+        self.run_scheduler()
+    
+    async def post_stop(self, application: Application):
+        """Finish in-flight work within SHUTDOWN_TIMEOUT once polling has stopped.
+
+        By now PTB has stopped fetching updates and processed the ones already
+        received. The bot is still connected, so queued messages can be sent.
+        """
+        deadline = time.monotonic() + self.shutdown_timeout
+        logger.info("Shutting down: finishing in-flight work within %.0fs", self.shutdown_timeout)
+        self.stopping = True
+        self.scheduler_stop.set()
+        await self.health.stop()
+        if self.backups and self.backups.running:
+            # A partial backup is discarded; the next scheduled one starts over
+            self.backups.cancel()
+        
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        
+        # A weekly run stops at the next member; what it queued is already durable
+        try:
+            await asyncio.wait_for(self.broadcast_lock.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            self.broadcast_lock.release()
+        except asyncio.TimeoutError:
+            logger.warning("Weekly survey run still in progress at shutdown")
         
-        init_database()
+        if self.group_survey:
+            try:
+                await asyncio.wait_for(self.group_survey.flush(application.bot),
+                                       timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                logger.warning("Group survey edits still pending at shutdown")
+        
+        await self.outbox.stop(timeout=max(0.0, deadline - time.monotonic()))
+        remaining = await self.storage.outbox_depth()
+        if remaining:
+            logger.info("%s queued messages will be delivered after restart", remaining)
+    
+    async def post_shutdown(self, application: Application):
+        """Persist dedup state and close storage connections."""
+        await self.deduplicator.save(self.storage, force=True)
+        await self.storage.close()
+        self.tracer.shutdown()
+    
+    async def drop_duplicate_updates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Stop processing of updates that were already handled."""
+        if self.deduplicator.is_duplicate(update.update_id):
+            logger.info("Dropping duplicate update %s", update.update_id,
+                        extra={'event': 'duplicate_update', 'update_id': update.update_id})
+            if update.callback_query:
+                await update.callback_query.answer()
+            raise ApplicationHandlerStop
+    
+    async def mark_update_processed(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Record that an update made it through the handlers, for deduplication and health checks."""
+        self.deduplicator.mark_processed(update.update_id)
+        self.health.mark_update_processed()
+        await self.deduplicator.save(self.storage)
+    
+    def is_polling(self) -> bool:
+        """Whether the updater is still fetching updates from Telegram."""
+        return bool(self.application and self.application.updater and self.application.updater.running)
+    
+    async def is_active_member(self, user_id: int) -> bool:
+        """Check if a user is an active family member."""
+        member = await self.storage.get_member(user_id)
+        return bool(member and member['is_active'])
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /start command."""
@@ -87,15 +204,10 @@ class MealsBot:
         last_name = update.effective_user.last_name
         
         # Check if user is already a family member
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT is_active FROM family_members WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        
-        if result:
-            if result[0]:  # User is active family member
+        member = await self.storage.get_member(user_id)
+
+        if member:
+            if member['is_active']:  # User is active family member
                 welcome_message = f"""
 🍽️ Welcome back, {first_name}!
 
@@ -106,7 +218,7 @@ You're already registered as a family member. Here's what you can do:
 /my_responses - View your recent responses
 /help - Show help information
 
-The bot will automatically send weekly surveys every Monday at 9:00 AM.
+The bot will automatically send weekly surveys every Monday morning (9:00 AM by default, change it with /send_time).
 
 Let's plan your meals! 🍳
                 """
@@ -122,12 +234,8 @@ Please contact the admin to be added back to the family meal planning.
                 """
         else:
             # New user - only admin can add them
-            cursor.execute('''
-                INSERT INTO family_members (user_id, username, first_name, last_name, is_active)
-                VALUES (?, ?, ?, ?, 0)
-            ''', (user_id, username, first_name, last_name))
-            conn.commit()
-            
+            await self.storage.add_member(user_id, username, first_name, last_name, is_active=False)
+
             welcome_message = f"""
 👋 Hi {first_name}!
 
@@ -143,8 +251,7 @@ Thanks for your interest in MealsBot! You're not yet registered as a family memb
 
 **Note:** Only the admin can add family members for security.
             """
-        
-        conn.close()
+
         await update.message.reply_text(welcome_message)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -153,7 +260,7 @@ Thanks for your interest in MealsBot! You're not yet registered as a family memb
 🍽️ **MealsBot Help**
 
 **How it works:**
-1. Every Monday at 9:00 AM, I'll send a survey asking about your meal needs
+1. Every Monday morning (9:00 AM in your timezone by default), I'll send a survey asking about your meal needs
 2. You can select which meals you need for each day of the week
 3. The admin gets a summary of everyone's needs
 4. You can also request surveys manually anytime
@@ -163,7 +270,11 @@ Thanks for your interest in MealsBot! You're not yet registered as a family memb
 /help - Show this help message
 /survey - Request a meal survey now
 /my_responses - View your recent responses
+/timezone - Show or set your timezone
+/send_time - Show or set when your weekly survey arrives
 /admin - Admin panel (admin only)
+/profile N - Profile the bot for N seconds (admin only)
+/backup - Back up the database now (admin only)
 
 **Meal Survey:**
 - Click the buttons to select which meals you need
@@ -180,15 +291,7 @@ Contact the admin if you have any issues or suggestions!
         user_id = update.effective_user.id
         
         # Check if user is an active family member
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT is_active FROM family_members WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result or not result[0]:
+        if not await self.is_active_member(user_id):
             await update.message.reply_text(
                 "❌ You're not registered as an active family member.\n\n"
                 "Please contact the admin to be added to the family meal planning group."
@@ -202,85 +305,261 @@ Contact the admin if you have any issues or suggestions!
         user_id = update.effective_user.id
         
         # Check if user is an active family member
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT is_active FROM family_members WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        
-        if not result or not result[0]:
+        if not await self.is_active_member(user_id):
             await update.message.reply_text(
                 "❌ You're not registered as an active family member.\n\n"
                 "Please contact the admin to be added to the family meal planning group."
             )
-            conn.close()
             return
-        
+
         # Get current week's responses
-        week_start = self.get_week_start()
-        cursor.execute('''
-            SELECT meal_type, day, response, timestamp
-            FROM meal_responses
-            WHERE user_id = ? AND week_start = ?
-            ORDER BY day, meal_type
-        ''', (user_id, week_start))
-        
-        responses = cursor.fetchall()
-        conn.close()
-        
+        week_start = await self.user_week_start(user_id)
+        responses = await self.storage.get_responses(user_id, week_start)
+
         if not responses:
             await update.message.reply_text("📝 You haven't responded to this week's survey yet. Use /survey to fill it out!")
             return
-        
+
         response_text = f"📋 **Your Meal Responses for Week of {week_start}**\n\n"
-        
+
         current_day = None
-        for meal_type, day, response, timestamp in responses:
+        for day, meal_type, response in self.ordered_responses(responses):
             if day != current_day:
                 response_text += f"**{day}:**\n"
                 current_day = day
-            
+
             status = "✅ Yes" if response else "❌ No"
             response_text += f"  • {meal_type.title()}: {status}\n"
         
         await update.message.reply_text(response_text)
     
+    async def timezone_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show or set the member's timezone, e.g. /timezone Europe/London."""
+        user_id = update.effective_user.id
+        
+        if not await self.is_active_member(user_id):
+            await update.message.reply_text("❌ You're not registered as an active family member.")
+            return
+        
+        if not context.args:
+            current = await self.member_timezone(user_id) or self.default_timezone or "server time"
+            await update.message.reply_text(
+                f"🌍 Your timezone is **{current}**.\n\n"
+                "Change it with `/timezone Area/City`, e.g. `/timezone Asia/Singapore`."
+            )
+            return
+        
+        timezone = context.args[0]
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            await update.message.reply_text(f"❌ Unknown timezone: {timezone}\n\nUse a name like `Europe/London`.")
+            return
+        
+        await self.storage.set_member_preferences(user_id, timezone=timezone)
+        self.timezones[user_id] = timezone
+        await update.message.reply_text(f"✅ Timezone set to **{timezone}**.")
+    
+    async def send_time_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show or set the member's preferred weekly survey time, e.g. /send_time 08:30."""
+        user_id = update.effective_user.id
+        
+        member = await self.storage.get_member(user_id)
+        if not member or not member['is_active']:
+            await update.message.reply_text("❌ You're not registered as an active family member.")
+            return
+        
+        if not context.args:
+            current = member['send_time'] or self.default_send_time
+            await update.message.reply_text(
+                f"⏰ Your weekly survey arrives on Mondays around **{current}**.\n\n"
+                "Change it with `/send_time HH:MM`, e.g. `/send_time 08:30`."
+            )
+            return
+        
+        try:
+            send_time = datetime.strptime(context.args[0], '%H:%M').strftime('%H:%M')
+        except ValueError:
+            await update.message.reply_text("❌ Please use the 24-hour HH:MM format, e.g. `/send_time 08:30`.")
+            return
+        
+        await self.storage.set_member_preferences(user_id, send_time=send_time)
+        await update.message.reply_text(f"✅ Weekly surveys will arrive on Mondays around **{send_time}**.")
+    
     async def admin_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle admin commands."""
         if update.effective_user.id != self.admin_user_id:
             await update.message.reply_text("❌ You don't have admin privileges.")
             return
         
+        text, reply_markup = await self.render_admin_panel()
+        await update.message.reply_text(text, reply_markup=reply_markup)
+    
+    async def render_admin_panel(self):
+        """Build the admin panel with today's live headcounts."""
+        timezone = await self.member_timezone(self.admin_user_id)
+        week_start = self.get_week_start(timezone)
+        today = self.local_now(timezone).strftime('%A')
+        # Live counters, so this costs no database query
+        headcounts = await self.storage.week_headcounts(week_start)
+        
+        today_counts = " · ".join(
+            f"{meal_type.title()[:3]} {headcounts.get((today, meal_type), 0)}" for meal_type in self.meal_types
+        )
+        text = (
+            "🔧 **Admin Panel**\n\n"
+            f"🍽️ **Today ({today}):** {today_counts}\n"
+            f"📊 **This week:** {sum(headcounts.values())} meals selected\n\n"
+            "Select an option:"
+        )
+        
         keyboard = [
             [InlineKeyboardButton("📊 View All Responses", callback_data="admin_view_responses")],
             [InlineKeyboardButton("👥 Manage Family Members", callback_data="admin_manage_family")],
             [InlineKeyboardButton("➕ Add Family Member", callback_data="admin_add_family")],
             [InlineKeyboardButton("📅 Send Survey Now", callback_data="admin_send_survey")],
-            [InlineKeyboardButton("📈 Weekly Summary", callback_data="admin_weekly_summary")]
+            [InlineKeyboardButton("📈 Weekly Summary", callback_data="admin_weekly_summary")],
+            [InlineKeyboardButton("📉 Trends & Forecast", callback_data="admin_trends")],
+            [InlineKeyboardButton("🔄 Refresh Headcounts", callback_data="admin_refresh")]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        return text, InlineKeyboardMarkup(keyboard)
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /profile N: profile the running bot for N seconds (admin only)."""
+        if update.effective_user.id != self.admin_user_id:
+            await update.message.reply_text("❌ You don't have admin privileges.")
+            return
+        
+        try:
+            seconds = int(context.args[0]) if context.args else 30
+        except ValueError:
+            seconds = 0
+        if not 1 <= seconds <= self.profiler.max_seconds:
+            await update.message.reply_text(
+                f"⚠️ Usage: /profile N, where N is between 1 and {self.profiler.max_seconds} seconds."
+            )
+            return
+        if self.profiler.running:
+            await update.message.reply_text("⏳ A profile is already running. Please wait for its results.")
+            return
         
         await update.message.reply_text(
-            "🔧 **Admin Panel**\n\nSelect an option:",
-            reply_markup=reply_markup
+            f"🔬 Profiling for {seconds} seconds. I'll send the results when it's done."
         )
+        # Profile in the background so updates keep flowing while data is collected;
+        # shutdown cancels it instead of waiting for the full window
+        task = asyncio.create_task(self.run_profile(update.effective_chat.id, seconds))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
     
-    async def send_meal_survey(self, chat_id: int, user_id: int):
-        """Send a meal survey to a specific user or group."""
-        week_start = self.get_week_start()
+    async def backup_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /backup: take an online backup of the database now (admin only)."""
+        if update.effective_user.id != self.admin_user_id:
+            await update.message.reply_text("❌ You don't have admin privileges.")
+            return
+        if not self.backups:
+            await update.message.reply_text(
+                f"⚠️ Backups are only available for a SQLite database file (current backend: {self.storage.name})."
+            )
+            return
+        if self.backups.running:
+            await update.message.reply_text("⏳ A backup is already running.")
+            return
         
-        # Get user's name for personalization
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT first_name FROM family_members WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        user_name = result[0] if result else "Family Member"
-        conn.close()
-        
-        message_text = f"""
+        await update.message.reply_text("💾 Backing up the database. The bot stays available meanwhile.")
+        # Shutdown cancels the backup rather than waiting for it
+        task = asyncio.create_task(self.report_backup(update.message))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+    
+    async def report_backup(self, message):
+        """Run a backup and reply with where it was written."""
+        try:
+            result = await self.run_backup()
+        except BackupCancelled:
+            return
+        except Exception as e:
+            logger.error("Backup failed: %s", e)
+            await message.reply_text(f"❌ Backup failed: {e}")
+            return
+        
+        await message.reply_text(
+            f"✅ **Backup complete**\n\n"
+            f"📁 {os.path.basename(result['path'])}\n"
+            f"👥 {result['members']} members, {result['responses']} responses\n"
+            f"📦 {result['bytes'] / 1e6:.2f} MB ({result['database_bytes'] / 1e6:.2f} MB uncompressed)\n"
+            f"⏱️ {result['seconds']:.1f}s in {result['steps']} steps\n"
+            f"🗂️ {len(self.backups.list())} backups kept"
+        )
+    
+    async def run_profile(self, chat_id: int, seconds: int):
+        """Profile for `seconds`, then send a summary and the full stats file."""
+        bot = self.application.bot
+        try:
+            profile = await self.profiler.run(seconds)
+            summary = self.profiler.summarize(profile)
+            path = os.path.join(tempfile.gettempdir(), f"mealsbot-{int(time.time())}.prof")
+            await asyncio.to_thread(profile.dump_stats, path)
+        except Exception as e:
+            logger.error("Profiling failed: %s", e)
+            await bot.send_message(chat_id=chat_id, text=f"❌ Profiling failed: {e}")
+            return
+        
+        try:
+            text = f"🔬 **Profile ({seconds}s)** - top functions by cumulative time:\n\n{summary}"
+            await bot.send_message(chat_id=chat_id, text=text[:4096])
+            with open(path, 'rb') as stats_file:
+                await bot.send_document(
+                    chat_id=chat_id,
+                    document=stats_file,
+                    filename=os.path.basename(path),
+                    caption="Full stats: open with `python -m pstats` or snakeviz"
+                )
+        except Exception as e:
+            logger.error("Failed to send profile results: %s", e)
+        finally:
+            os.remove(path)
+    
+    def meal_button(self, day: str, meal_type: str, user_id: int, is_selected: bool) -> InlineKeyboardButton:
+        """Build a survey button whose callback sets the cell to the opposite of its current value."""
+        status = "✅" if is_selected else "❌"
+        target = 0 if is_selected else 1
+        return InlineKeyboardButton(
+            f"{meal_type.title()[:3]} {status}",
+            callback_data=f"meal_{day.lower()}_{meal_type}_{user_id}_{target}"
+        )
+    
+    def build_survey_keyboard(self, user_id: int, responses: Dict) -> InlineKeyboardMarkup:
+        """Build the full survey keyboard for a user's current selections."""
+        keyboard = []
+        for day in self.days:
+            day_buttons = [
+                self.meal_button(day, meal_type, user_id, responses.get((day, meal_type), False))
+                for meal_type in self.meal_types
+            ]
+            keyboard.append([InlineKeyboardButton(f"📅 {day}", callback_data="day_header")] + day_buttons)
+        
+        keyboard.append([
+            InlineKeyboardButton("↩️ Same as Last Week", callback_data=f"bulk_copy_{user_id}"),
+            InlineKeyboardButton("✅ All", callback_data=f"bulk_all_{user_id}"),
+            InlineKeyboardButton("🧹 Clear", callback_data=f"bulk_clear_{user_id}")
+        ])
+        keyboard.append([
+            InlineKeyboardButton(f"All {meal_type.title()}", callback_data=f"bulk_{meal_type}_{user_id}")
+            for meal_type in self.meal_types
+        ])
+        keyboard.append([
+            InlineKeyboardButton("👀 Review Selection", callback_data=f"review_survey_{user_id}"),
+            InlineKeyboardButton("✅ Submit Survey", callback_data=f"submit_survey_{user_id}")
+        ])
+        
+        return InlineKeyboardMarkup(keyboard)
+    
+    @staticmethod
+    def survey_text(user_name: Optional[str], week_start: str) -> str:
+        """Build the survey message text for a member."""
+        user_name = user_name or "Family Member"
+        return f"""
 🍽️ **Weekly Meal Survey - Week of {week_start}**
 
 Hi {user_name}! Please let us know which meals you'll need this week:
@@ -289,66 +568,107 @@ Hi {user_name}! Please let us know which meals you'll need this week:
 • Click the buttons below to select your meals
 • Selected meals will show ✅
 • Unselected meals will show ❌
+• Use the quick buttons to copy last week or set many meals at once
 • Click "Submit Survey" when done
 
 Let's plan the perfect week of meals! 🍳
         """
+    
+    async def render_meal_survey(self, user_id: int):
+        """Build the survey message text and keyboard for a user."""
+        week_start = await self.user_week_start(user_id)
         
-        # Get existing responses for this week
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT day, meal_type, response
-            FROM meal_responses
-            WHERE user_id = ? AND week_start = ?
-        ''', (user_id, week_start))
-        
-        existing_responses = {}
-        for day, meal_type, response in cursor.fetchall():
-            existing_responses[f"{day}_{meal_type}"] = response
-        
-        conn.close()
+        # Get user's name for personalization
+        message_text = self.survey_text(await self.storage.get_first_name(user_id), week_start)
         
+        # Get existing responses for this week
+        existing_responses = await self.storage.get_responses(user_id, week_start)
+
         # Create keyboard with meal selection buttons (restore previous selections)
-        keyboard = []
-        for day in self.days:
-            day_buttons = []
-            for meal_type in self.meal_types:
-                callback_data = f"meal_{day.lower()}_{meal_type}_{user_id}"
-                
-                # Check if this meal was previously selected
-                key = f"{day}_{meal_type}"
-                is_selected = existing_responses.get(key, False)
-                status = "✅" if is_selected else "❌"
-                
-                day_buttons.append(InlineKeyboardButton(
-                    f"{meal_type.title()[:3]} {status}", 
-                    callback_data=callback_data
-                ))
-            keyboard.append([InlineKeyboardButton(f"📅 {day}", callback_data="day_header")] + day_buttons)
-        
-        keyboard.append([
-            InlineKeyboardButton("👀 Review Selection", callback_data=f"review_survey_{user_id}"),
-            InlineKeyboardButton("✅ Submit Survey", callback_data=f"submit_survey_{user_id}")
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+        with self.tracer.span('render.survey_keyboard'):
+            reply_markup = self.build_survey_keyboard(user_id, existing_responses)
+
+        return message_text, reply_markup
+    
+    def render_surveys(self, week_start: str, members: List[Dict], responses: Dict[int, Dict], dedup_prefix: str,
+                       not_before: Optional[Dict[int, float]] = None) -> List[Dict]:
+        """Render surveys for a week from batch-loaded members and responses, as outbox messages."""
+        not_before = not_before or {}
+        with self.tracer.span('render.survey_batch', **{'survey.count': len(members)}):
+            return [
+                {
+                    'chat_id': member['user_id'],
+                    'text': self.survey_text(member['first_name'], week_start),
+                    'reply_markup': self.build_survey_keyboard(member['user_id'],
+                                                               responses.get(member['user_id'], {})),
+                    'dedup_key': f"{dedup_prefix}:{member['user_id']}",
+                    'not_before': not_before.get(member['user_id'], 0.0),
+                }
+                for member in members
+            ]
+    
+    async def send_meal_survey(self, chat_id: int, user_id: int):
+        """Send a meal survey to a specific user or group."""
+        message_text, reply_markup = await self.render_meal_survey(user_id)
+
         await self.application.bot.send_message(
             chat_id=chat_id,
             text=message_text,
             reply_markup=reply_markup
         )
     
+    async def queue_rendered_surveys(self, week_start: str, members: List[Dict], dedup_prefix: str,
+                                     not_before: Optional[Dict[int, float]] = None) -> Dict:
+        """Load a week's responses once, render every member's survey and queue them in one transaction.
+
+        Members who already answered that week and aren't due yet are left
+        out, so their survey shows any changes they make before their slot;
+        a later run renders them once their slot arrives.
+        """
+        started = time.perf_counter()
+        responses = await self.storage.week_responses(week_start)
+        loaded = time.perf_counter()
+        if not_before:
+            now = time.time()
+            members = [member for member in members
+                       if member['user_id'] not in responses or not_before.get(member['user_id'], 0.0) <= now]
+        messages = self.render_surveys(week_start, members, responses, dedup_prefix, not_before)
+        rendered = time.perf_counter()
+        queued = await self.outbox.enqueue_rendered(messages)
+        return {
+            'user_ids': [member['user_id'] for member in members],
+            'rendered': len(messages),
+            'queued': queued,
+            'load_ms': (loaded - started) * 1000,
+            'render_ms': (rendered - loaded) * 1000,
+            'enqueue_ms': (time.perf_counter() - rendered) * 1000,
+        }
+    
     async def handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle callback queries from inline keyboards."""
+        """Handle callback queries from inline keyboards, shedding excess load."""
         query = update.callback_query
-        await query.answer()
+        is_admin = query.from_user.id == self.admin_user_id
+        
+        if not self.callback_throttle.try_acquire(query.from_user.id, priority=is_admin):
+            await query.answer("⏳ Slow down! Please wait a moment before tapping again.")
+            return
         
+        try:
+            # Group survey taps answer with a personal confirmation instead
+            if not query.data.startswith(("gmeal_", "gmine_")):
+                await query.answer()
+            await self.process_callback_query(query)
+        finally:
+            self.callback_throttle.release()
+    
+    async def process_callback_query(self, query):
+        """Dispatch an admitted callback query."""
         data = query.data
         user_id = query.from_user.id
         
-        logger.info(f"Callback received: {data} from user {user_id}")
+        event = 'meal_toggle' if data.startswith(("meal_", "gmeal_")) else 'callback'
+        logger.info("Callback received: %s from user %s", data, user_id,
+                    extra={'event': event, 'user_id': user_id, 'data': data})
         
         if data.startswith("meal_"):
             # Handle meal selection
@@ -362,58 +682,39 @@ Let's plan the perfect week of meals! 🍳
                 await query.message.reply_text("❌ You can only modify your own meal preferences.")
                 return
             
-            # Toggle meal response
-            conn = sqlite3.connect('meals_bot.db')
-            cursor = conn.cursor()
-            
-            week_start = self.get_week_start()
-            
-            # Check if response exists
-            cursor.execute('''
-                SELECT response FROM meal_responses
-                WHERE user_id = ? AND week_start = ? AND day = ? AND meal_type = ?
-            ''', (target_user_id, week_start, day, meal_type))
-            
-            result = cursor.fetchone()
-            current_response = result[0] if result else None
-            
-            if current_response is None:
-                # Insert new response
-                cursor.execute('''
-                    INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (target_user_id, week_start, meal_type, day, True))
-                new_response = True
+            week_start = await self.user_week_start(target_user_id)
+            if len(parts) > 4:
+                # Set the cell to the value carried by the button, so a
+                # double-tap or redelivered callback is a no-op. The cell is
+                # still redrawn below in case this message showed an old value;
+                # edit_survey_keyboard skips the edit if nothing would change.
+                new_response = parts[4] == "1"
+                await self.storage.set_response(target_user_id, week_start, day, meal_type, new_response)
             else:
-                # Toggle existing response
-                new_response = not current_response
-                cursor.execute('''
-                    UPDATE meal_responses SET response = ?
-                    WHERE user_id = ? AND week_start = ? AND day = ? AND meal_type = ?
-                ''', (new_response, target_user_id, week_start, day, meal_type))
-            
-            conn.commit()
-            conn.close()
-            
-            # Create new keyboard with updated button text
-            status = "✅" if new_response else "❌"
-            button_text = f"{meal_type.title()[:3]} {status}"
-            
-            # Recreate the keyboard with updated button
-            new_keyboard = []
-            for row in query.message.reply_markup.inline_keyboard:
-                new_row = []
-                for button in row:
-                    if button.callback_data == data:
-                        # Create new button with updated text
-                        new_button = InlineKeyboardButton(button_text, callback_data=data)
-                        new_row.append(new_button)
-                    else:
-                        new_row.append(button)
-                new_keyboard.append(new_row)
-            
-            new_reply_markup = InlineKeyboardMarkup(new_keyboard)
-            await query.edit_message_reply_markup(reply_markup=new_reply_markup)
+                # Buttons sent before set-to-value callbacks still toggle
+                new_response = await self.storage.toggle_response(target_user_id, week_start, day, meal_type)
+
+            # Recreate the keyboard with the updated button
+            with self.tracer.span('render.survey_keyboard'):
+                cell_data = f"meal_{parts[1]}_{meal_type}_{target_user_id}"
+                new_keyboard = []
+                for row in query.message.reply_markup.inline_keyboard:
+                    new_row = []
+                    for button in row:
+                        if button.callback_data == cell_data or button.callback_data.startswith(cell_data + "_"):
+                            new_row.append(self.meal_button(day, meal_type, target_user_id, new_response))
+                        else:
+                            new_row.append(button)
+                    new_keyboard.append(new_row)
+                
+                new_reply_markup = InlineKeyboardMarkup(new_keyboard)
+            await self.edit_survey_keyboard(query, new_reply_markup)
+        
+        elif data.startswith(("gmeal_", "gmine_")):
+            await self.handle_group_survey_callback(query, data)
+        
+        elif data.startswith("bulk_"):
+            await self.handle_bulk_selection(query, data)
         
         elif data.startswith("review_survey_"):
             # Handle survey review
@@ -424,20 +725,9 @@ Let's plan the perfect week of meals! 🍳
                 await query.message.reply_text("❌ You can only review your own survey.")
                 return
             
-            conn = sqlite3.connect('meals_bot.db')
-            cursor = conn.cursor()
-            
-            week_start = self.get_week_start()
-            cursor.execute('''
-                SELECT meal_type, day, response
-                FROM meal_responses
-                WHERE user_id = ? AND week_start = ?
-                ORDER BY day, meal_type
-            ''', (target_user_id, week_start))
-            
-            responses = cursor.fetchall()
-            conn.close()
-            
+            week_start = await self.user_week_start(target_user_id)
+            responses = await self.storage.get_responses(target_user_id, week_start)
+
             if not responses:
                 await query.message.reply_text(
                     "📝 **No meals selected yet!**\n\n"
@@ -445,21 +735,14 @@ Let's plan the perfect week of meals! 🍳
                 )
             else:
                 # Get user's name
-                conn = sqlite3.connect('meals_bot.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT first_name FROM family_members WHERE user_id = ?
-                ''', (target_user_id,))
-                result = cursor.fetchone()
-                user_name = result[0] if result else "Family Member"
-                conn.close()
-                
+                user_name = await self.storage.get_first_name(target_user_id) or "Family Member"
+
                 review_text = f"👀 **Survey Review - {user_name}**\n"
                 review_text += f"**Week of {week_start}**\n\n"
-                
+
                 current_day = None
                 selected_count = 0
-                for meal_type, day, response in responses:
+                for day, meal_type, response in self.ordered_responses(responses):
                     if day != current_day:
                         review_text += f"📅 **{day}:**\n"
                         current_day = day
@@ -482,33 +765,17 @@ Let's plan the perfect week of meals! 🍳
                 await query.message.reply_text("❌ You can only submit your own survey.")
                 return
             
-            conn = sqlite3.connect('meals_bot.db')
-            cursor = conn.cursor()
-            
-            week_start = self.get_week_start()
-            cursor.execute('''
-                SELECT COUNT(*) FROM meal_responses
-                WHERE user_id = ? AND week_start = ?
-            ''', (target_user_id, week_start))
-            
-            response_count = cursor.fetchone()[0]
-            conn.close()
-            
+            week_start = await self.user_week_start(target_user_id)
+            response_count = await self.storage.count_responses(target_user_id, week_start)
+
             if response_count == 0:
                 await query.message.reply_text(
                     "⚠️ Please select at least one meal before submitting!"
                 )
             else:
                 # Get user's name
-                conn = sqlite3.connect('meals_bot.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT first_name FROM family_members WHERE user_id = ?
-                ''', (target_user_id,))
-                result = cursor.fetchone()
-                user_name = result[0] if result else "Family Member"
-                conn.close()
-                
+                user_name = await self.storage.get_first_name(target_user_id) or "Family Member"
+
                 await query.message.reply_text(
                     f"✅ **Survey Submitted Successfully, {user_name}!**\n\n"
                     "Thank you for your responses. The admin will be notified of your meal preferences for this week. "
@@ -516,17 +783,14 @@ Let's plan the perfect week of meals! 🍳
                 )
                 
                 # Notify admin of new submission
-                try:
-                    await self.application.bot.send_message(
-                        chat_id=self.admin_user_id,
-                        text=f"📝 **New Survey Submission**\n\n"
-                             f"**User:** {user_name}\n"
-                             f"**Week:** {week_start}\n"
-                             f"**Meals Selected:** {response_count}\n\n"
-                             f"Use `/admin` → 'View All Responses' to see details."
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify admin of submission: {e}")
+                await self.outbox.enqueue(
+                    self.admin_user_id,
+                    f"📝 **New Survey Submission**\n\n"
+                    f"**User:** {user_name}\n"
+                    f"**Week:** {week_start}\n"
+                    f"**Meals Selected:** {response_count}\n\n"
+                    f"Use `/admin` → 'View All Responses' to see details."
+                )
         
         elif data.startswith("activate_"):
             await self.activate_family_member(query, data)
@@ -536,73 +800,164 @@ Let's plan the perfect week of meals! 🍳
         elif data.startswith("admin_"):
             await self.handle_admin_callback(query, data)
     
+    async def handle_group_survey_callback(self, query, data):
+        """Toggle the tapping member's own meal on the shared group survey."""
+        user_id = query.from_user.id
+        if not self.group_survey:
+            await query.answer("⚠️ Group surveys are turned off. Use /survey instead.", show_alert=True)
+            return
+        if not await self.is_active_member(user_id):
+            await query.answer("❌ Only active family members can answer the survey.", show_alert=True)
+            return
+        
+        parts = data.split("_")
+        week_start = parts[1]
+        if parts[0] == "gmine":
+            responses = await self.storage.get_responses(user_id, week_start)
+            await query.answer(self.group_survey.selection_summary(responses), show_alert=True)
+            return
+        
+        day = parts[2].title()
+        meal_type = parts[3]
+        if len(parts) > 4:
+            # A double tap under the same render sets the same value again
+            current = (await self.storage.get_responses(user_id, week_start)).get((day, meal_type), False)
+            selected = self.group_survey.tap_target(parts[4], user_id, day, meal_type, current)
+            changed = await self.storage.set_response(user_id, week_start, day, meal_type, selected)
+        else:
+            # Messages posted before render tokens still toggle
+            selected = await self.storage.toggle_response(user_id, week_start, day, meal_type)
+            changed = True
+        await query.answer(f"{'✅ Added' if selected else '❌ Removed'}: {day} {meal_type}")
+        if changed:
+            self.group_survey.request_refresh(
+                self.application.bot, query.message.chat_id, query.message.message_id, week_start
+            )
+    
+    async def handle_bulk_selection(self, query, data):
+        """Apply a whole-week survey action in one write and re-render the keyboard once."""
+        _, action, target = data.split("_")
+        target_user_id = int(target)
+        
+        # Only allow the target user to modify their responses
+        if query.from_user.id != target_user_id:
+            await query.message.reply_text("❌ You can only modify your own meal preferences.")
+            return
+        
+        week_start = await self.user_week_start(target_user_id)
+        current = await self.storage.get_responses(target_user_id, week_start)
+        
+        if action == "copy":
+            last_week = self.previous_week_start(week_start)
+            updated = await self.storage.get_responses(target_user_id, last_week)
+            if not updated:
+                await query.message.reply_text("📝 You didn't respond to last week's survey, so there is nothing to copy.")
+                return
+            if updated != current:
+                await self.storage.copy_week_responses(target_user_id, last_week, week_start)
+        elif action == "clear":
+            # Remove the answers rather than storing 21 unselected meals
+            updated = {}
+            if current:
+                await self.storage.clear_week_responses(target_user_id, week_start)
+        else:
+            if action == "all":
+                cells = [(day, meal_type) for day in self.days for meal_type in self.meal_types]
+            elif action in self.meal_types:
+                cells = [(day, action) for day in self.days]
+            else:
+                return
+            updated = dict(current)
+            updated.update({cell: True for cell in cells})
+            if updated != current:
+                await self.storage.set_responses(target_user_id, week_start, cells, True)
+        
+        await self.edit_survey_keyboard(query, self.build_survey_keyboard(target_user_id, updated))
+    
+    async def edit_survey_keyboard(self, query, reply_markup: InlineKeyboardMarkup):
+        """Replace a survey message's keyboard, skipping the edit when it would look the same."""
+        # e.g. a double tap, or clearing a week with no answers
+        if reply_markup == query.message.reply_markup:
+            return
+        try:
+            await query.edit_message_reply_markup(reply_markup=reply_markup)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+    
     async def handle_admin_callback(self, query, data):
         """Handle admin-specific callback queries."""
         if query.from_user.id != self.admin_user_id:
             await query.message.reply_text("❌ You don't have admin privileges.")
             return
         
+        # Reports and broadcasts run in the background so they don't hold up the admin's next taps
         if data == "admin_view_responses":
-            await self.show_all_responses(query)
+            self.run_in_background("view_responses", self.show_all_responses(query))
         elif data == "admin_manage_family":
             await self.manage_family_members(query)
         elif data == "admin_add_family":
             await self.show_pending_family_members(query)
         elif data == "admin_send_survey":
-            await self.send_survey_to_all(query)
+            self.run_in_background("send_survey", self.send_survey_to_all(query))
         elif data == "admin_weekly_summary":
             await self.show_weekly_summary(query)
+        elif data == "admin_refresh":
+            await self.refresh_admin_panel(query)
+        elif data == "admin_trends":
+            self.run_in_background("trends", self.show_trends(query))
+        elif data.startswith("admin_pick_"):
+            await self.toggle_pending_selection(query, int(data.split("_")[2]))
+        elif data in ("admin_approve_selected", "admin_reject_selected", "admin_approve_all"):
+            await self.bulk_update_family_members(query, data)
+    
+    def run_in_background(self, name: str, coro):
+        """Run a long operation as its own task; PTB waits for it on shutdown."""
+        async def run():
+            with self.tracer.trace(f"background.{name}"):
+                try:
+                    await coro
+                except Exception as e:
+                    logger.error("Background task %s failed: %s", name, e)
+        
+        self.application.create_task(run())
+    
+    async def cached_report(self, kind: str, week_start: str, render, load=None) -> str:
+        """Render a report from a read-only snapshot, reusing it until storage is written to."""
+        version = self.storage.write_version
+        cached = self.report_cache.get((kind, week_start))
+        if cached and cached[0] == version:
+            return cached[1]
+        
+        snapshot = await (load or self.storage.report_snapshot)(week_start)
+        text = render(week_start, snapshot)
+        # Drop other weeks' reports; only the current week is ever requested
+        self.report_cache = {key: value for key, value in self.report_cache.items() if key[1] == week_start}
+        self.report_cache[(kind, week_start)] = (version, text)
+        return text
     
     async def show_all_responses(self, query):
         """Show all family members' responses for the current week."""
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        
         week_start = self.get_week_start()
-        
-        # Get all active family members
-        cursor.execute('''
-            SELECT user_id, first_name, last_name, username
-            FROM family_members
-            WHERE is_active = 1
-        ''')
-        
-        family_members = cursor.fetchall()
-        
+        summary_text = await self.cached_report("responses", week_start, self.render_all_responses)
+        await query.message.reply_text(summary_text)
+    
+    def render_all_responses(self, week_start: str, snapshot: Dict) -> str:
+        """Build the per-member responses report."""
+        family_members = snapshot['members']
+        week_responses = snapshot['responses']
+
         summary_text = f"📊 **Weekly Meal Summary - Week of {week_start}**\n\n"
-        
-        for user_id, first_name, last_name, username in family_members:
-            name = f"{first_name} {last_name}" if last_name else first_name
-            if username:
-                name += f" (@{username})"
-            
-            summary_text += f"👤 **{name}**\n"
-            
-            # Get responses for this user with proper chronological ordering
-            cursor.execute('''
-                SELECT meal_type, day, response
-                FROM meal_responses
-                WHERE user_id = ? AND week_start = ?
-            ''', (user_id, week_start))
-            
-            responses = cursor.fetchall()
-            
-            # Define proper day and meal order
-            day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-            meal_order = ['breakfast', 'lunch', 'dinner']
-            
-            # Sort responses by day and meal order
-            def sort_key(response):
-                meal_type, day, _ = response
-                day_index = day_order.index(day) if day in day_order else 999
-                meal_index = meal_order.index(meal_type) if meal_type in meal_order else 999
-                return (day_index, meal_index)
-            
-            responses = sorted(responses, key=sort_key)
-            
+
+        for member in family_members:
+            summary_text += f"👤 **{self.display_name(member)}**\n"
+
+            # Responses in proper chronological order
+            responses = self.ordered_responses(week_responses.get(member['user_id'], {}))
+
             if responses:
                 current_day = None
-                for meal_type, day, response in responses:
+                for day, meal_type, response in responses:
                     if day != current_day:
                         summary_text += f"  📅 {day}:\n"
                         current_day = day
@@ -613,37 +968,24 @@ Let's plan the perfect week of meals! 🍳
                 summary_text += "  ⚠️ No responses yet\n"
             
             summary_text += "\n"
-        
-        conn.close()
-        
-        await query.message.reply_text(summary_text)
+
+        return summary_text
     
     async def manage_family_members(self, query):
         """Show family member management options."""
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT user_id, first_name, last_name, username, is_active
-            FROM family_members
-            ORDER BY is_active DESC, first_name
-        ''')
-        
-        members = cursor.fetchall()
-        conn.close()
-        
+        members = await self.storage.list_members()
+
         members_text = "👥 **Family Members Management**\n\n"
         keyboard = []
-        
-        for user_id, first_name, last_name, username, is_active in members:
-            name = f"{first_name} {last_name}" if last_name else first_name
-            if username:
-                name += f" (@{username})"
-            
-            status = "🟢 Active" if is_active else "🔴 Inactive"
-            members_text += f"• {name} - {status}\n"
-            
-            if is_active:
+
+        for member in members:
+            user_id = member['user_id']
+            first_name = member['first_name']
+
+            status = "🟢 Active" if member['is_active'] else "🔴 Inactive"
+            members_text += f"• {self.display_name(member)} - {status}\n"
+
+            if member['is_active']:
                 keyboard.append([
                     InlineKeyboardButton(f"❌ Remove {first_name}", callback_data=f"deactivate_{user_id}")
                 ])
@@ -660,82 +1002,162 @@ Let's plan the perfect week of meals! 🍳
         await query.message.reply_text(members_text, reply_markup=reply_markup)
     
     async def send_survey_to_all(self, query):
-        """Send survey to all active family members."""
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT user_id FROM family_members WHERE is_active = 1
-        ''')
-        
-        active_members = cursor.fetchall()
-        conn.close()
+        """Send survey to all active family members, or post it to the family group."""
+        if self.group_survey:
+            week_start = self.get_week_start(self.default_timezone)
+            try:
+                await self.group_survey.post(self.application.bot, week_start)
+            except Exception as e:
+                logger.error("Failed to post group survey: %s", e)
+                await query.message.reply_text(f"❌ Couldn't post the survey to the family chat: {e}")
+                return
+            await query.message.reply_text(
+                f"📤 **Survey posted to the family chat!**\n\n"
+                f"Week of {week_start}. Headcounts on its buttons update as members answer."
+            )
+            return
         
-        sent_count = 0
+        active_members = await self.storage.list_members(is_active=True)
+
+        # Members in other timezones can be in a different week
+        weeks: Dict[str, List[Dict]] = {}
+        for member in active_members:
+            weeks.setdefault(self.get_week_start(member['timezone']), []).append(member)
+
+        queued_count = 0
         failed_count = 0
-        
-        for (user_id,) in active_members:
+        render_ms = 0.0
+
+        for week_start, members in weeks.items():
             try:
-                await self.send_meal_survey(user_id, user_id)
-                sent_count += 1
+                # Keyed by the callback so a redelivered tap can't send twice
+                result = await self.queue_rendered_surveys(week_start, members, f"survey_broadcast:{query.id}")
+                queued_count += result['rendered']
+                render_ms += result['render_ms']
             except Exception as e:
-                logger.error(f"Failed to send survey to user {user_id}: {e}")
-                failed_count += 1
+                logger.error("Failed to queue surveys for week %s: %s", week_start, e)
+                failed_count += len(members)
         
         # Send detailed report to admin
-        report_text = f"📤 **Survey Distribution Complete!**\n\n"
-        report_text += f"✅ **Successfully sent:** {sent_count} surveys\n"
+        report_text = f"📤 **Survey Distribution Queued!**\n\n"
+        report_text += f"✅ **Queued for delivery:** {queued_count} surveys\n"
         
         if failed_count > 0:
-            report_text += f"❌ **Failed to send:** {failed_count} surveys\n"
-            report_text += f"*Some users may have blocked the bot or have privacy settings preventing messages.*\n"
+            report_text += f"❌ **Failed to queue:** {failed_count} surveys\n"
         
-        report_text += f"\n📊 **Total active family members:** {len(active_members)}"
+        report_text += f"⚡ **Rendered in:** {render_ms:.0f} ms\n"
+        report_text += f"\n📊 **Total active family members:** {len(active_members)}\n"
+        report_text += "*Surveys are delivered in the background; undeliverable ones (e.g. blocked bot) are logged.*"
         
         await query.message.reply_text(report_text)
     
     async def show_weekly_summary(self, query):
-        """Show a summary of the week's meal needs."""
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        
+        """Show a summary of the week's meal needs from the live headcounts."""
         week_start = self.get_week_start()
-        
+        headcounts = await self.storage.week_headcounts(week_start)
+        await query.message.reply_text(self.render_weekly_summary(week_start, headcounts))
+    
+    def render_weekly_summary(self, week_start: str, headcounts: Dict) -> str:
+        """Build the headcount summary report."""
+
         summary_text = f"📈 **Weekly Meal Summary - Week of {week_start}**\n\n"
-        
+
         for day in self.days:
             summary_text += f"📅 **{day}**\n"
-            
+
             for meal_type in self.meal_types:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM meal_responses
-                    WHERE week_start = ? AND day = ? AND meal_type = ? AND response = 1
-                ''', (week_start, day, meal_type))
-                
-                count = cursor.fetchone()[0]
+                count = headcounts.get((day, meal_type), 0)
                 summary_text += f"  • {meal_type.title()}: {count} people\n"
-            
+
             summary_text += "\n"
+
+        return summary_text
+    
+    async def show_trends(self, query):
+        """Show headcount trends, attendance rates and next week's forecast."""
+        week_start = self.get_week_start()
+        trends_text = await self.cached_report("trends", week_start, self.render_trends, load=self.load_trends)
+        await query.message.reply_text(trends_text)
+    
+    async def load_trends(self, week_start: str) -> Dict:
+        """Load up to TREND_HISTORY_WEEKS weeks of responses into a headcount cube."""
+        started = time.perf_counter()
+        first_week = (date.fromisoformat(week_start) - timedelta(weeks=self.trend_history_weeks - 1)).isoformat()
+        rows = await self.storage.responses_between(first_week, week_start)
+        members = await self.storage.list_members()
+        if rows:
+            # Start at the first week with data so empty weeks don't drag the averages down
+            first_week = min(rows)[0]
+        # Scattering years of rows takes tens of milliseconds, so do it off the event loop
+        cube = await asyncio.to_thread(HeadcountCube.from_rows, week_range(first_week, week_start),
+                                       [m['user_id'] for m in members], rows, self.days, self.meal_types)
+        return {'cube': cube, 'members': members, 'rows': len(rows),
+                'load_ms': (time.perf_counter() - started) * 1000}
+    
+    def render_trends(self, week_start: str, snapshot: Dict) -> str:
+        """Build the trends and forecast report."""
+        if not snapshot['rows']:
+            return "📉 **Meal Trends**\n\nNo responses have been recorded yet."
+        
+        started = time.perf_counter()
+        cube = snapshot['cube']
+        window = min(self.trend_window, len(cube.weeks))
+        rolling = cube.rolling_mean(window)
+        # Compare with the window before, when there is that much history
+        previous = rolling[-1 - window] if len(rolling) > window else None
+        forecast = cube.forecast()
+        weeks_answered, rates = cube.attendance()
+        analysis_ms = (time.perf_counter() - started) * 1000
+        
+        next_week = (date.fromisoformat(week_start) + timedelta(weeks=1)).isoformat()
+        text = f"📉 **Meal Trends - {len(cube.weeks)} weeks to week of {week_start}**\n\n"
+        
+        text += f"**{window}-week average headcount:**\n"
+        for d, day in enumerate(self.days):
+            cells = []
+            for m, meal_type in enumerate(self.meal_types):
+                arrow = ""
+                if previous is not None:
+                    change = rolling[-1, d, m] - previous[d, m]
+                    arrow = "↑" if change >= 0.5 else "↓" if change <= -0.5 else ""
+                cells.append(f"{meal_type.title()[:3]} {rolling[-1, d, m]:.1f}{arrow}")
+            text += f"📅 {day[:3]}: {' · '.join(cells)}\n"
+        
+        text += f"\n🔮 **Forecast for week of {next_week}:**\n"
+        for d, day in enumerate(self.days):
+            cells = [f"{meal_type.title()[:3]} {round(forecast[d, m])}" for m, meal_type in enumerate(self.meal_types)]
+            text += f"📅 {day[:3]}: {' · '.join(cells)}\n"
+        
+        text += "\n👥 **Attendance** (share of meals in weeks answered):\n"
+        attendance = sorted(
+            ((rates[i], weeks_answered[i], member) for i, member in enumerate(snapshot['members'])
+             if member['is_active']),
+            key=lambda item: item[0], reverse=True
+        )
+        for rate, weeks, member in attendance:
+            if weeks:
+                text += f"• {self.display_name(member)}: {rate:.0%} over {weeks} weeks\n"
+            else:
+                text += f"• {self.display_name(member)}: no responses\n"
         
-        conn.close()
-        
-        await query.message.reply_text(summary_text)
+        text += (f"\n⏱️ {snapshot['rows']} responses loaded in {snapshot['load_ms']:.1f} ms, "
+                 f"analysed in {analysis_ms:.1f} ms")
+        return text
+    
+    async def refresh_admin_panel(self, query):
+        """Redraw the admin panel with the latest headcounts."""
+        text, reply_markup = await self.render_admin_panel()
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            # Nothing changed since the panel was drawn
+            if 'not modified' not in str(e).lower():
+                raise
     
     async def show_pending_family_members(self, query):
         """Show pending family members waiting to be added."""
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT user_id, first_name, last_name, username
-            FROM family_members
-            WHERE is_active = 0
-            ORDER BY first_name
-        ''')
-        
-        pending_members = cursor.fetchall()
-        conn.close()
-        
+        pending_members = await self.storage.list_members(is_active=False)
+
         if not pending_members:
             await query.message.reply_text(
                 "✅ **No Pending Family Members**\n\n"
@@ -743,49 +1165,115 @@ Let's plan the perfect week of meals! 🍳
             )
             return
         
+        # Start each pending list with a fresh multi-select
+        self.pending_selection.clear()
+        
         members_text = "👥 **Pending Family Members**\n\n"
+        for member in pending_members:
+            members_text += f"• {self.display_name(member)}\n"
+        
+        await query.message.reply_text(
+            members_text + "\n**Select an action, or tick several members and apply it to all of them:**",
+            reply_markup=self.build_pending_keyboard(pending_members)
+        )
+    
+    def build_pending_keyboard(self, pending_members: List[Dict]) -> InlineKeyboardMarkup:
+        """Build the pending members keyboard with per-member and multi-select actions."""
         keyboard = []
         
-        for user_id, first_name, last_name, username in pending_members:
-            name = f"{first_name} {last_name}" if last_name else first_name
-            if username:
-                name += f" (@{username})"
+        for member in pending_members:
+            user_id = member['user_id']
+            first_name = member['first_name']
+            tick = "☑️" if user_id in self.pending_selection else "⬜"
             
-            members_text += f"• {name}\n"
             keyboard.append([
-                InlineKeyboardButton(f"✅ Add {first_name}", callback_data=f"activate_{user_id}"),
-                InlineKeyboardButton(f"❌ Reject {first_name}", callback_data=f"deactivate_{user_id}")
+                InlineKeyboardButton(f"{tick} {first_name}", callback_data=f"admin_pick_{user_id}"),
+                InlineKeyboardButton("✅ Add", callback_data=f"activate_{user_id}"),
+                InlineKeyboardButton("❌ Reject", callback_data=f"deactivate_{user_id}")
             ])
         
+        selected = len(self.pending_selection)
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Approve Selected ({selected})", callback_data="admin_approve_selected"),
+            InlineKeyboardButton(f"❌ Reject Selected ({selected})", callback_data="admin_reject_selected")
+        ])
+        keyboard.append([InlineKeyboardButton("✅ Approve All Pending", callback_data="admin_approve_all")])
         keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_back")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.message.reply_text(
-            members_text + "\n**Select an action:**",
-            reply_markup=reply_markup
+        return InlineKeyboardMarkup(keyboard)
+    
+    async def toggle_pending_selection(self, query, user_id: int):
+        """Tick or untick a pending member for a bulk action."""
+        if user_id in self.pending_selection:
+            self.pending_selection.discard(user_id)
+        else:
+            self.pending_selection.add(user_id)
+        
+        pending_members = await self.storage.list_members(is_active=False)
+        await query.edit_message_reply_markup(reply_markup=self.build_pending_keyboard(pending_members))
+    
+    async def bulk_update_family_members(self, query, data):
+        """Approve or reject several pending members in one transaction."""
+        if data == "admin_approve_all":
+            user_ids = [member['user_id'] for member in await self.storage.list_members(is_active=False)]
+        else:
+            user_ids = sorted(self.pending_selection)
+        
+        if not user_ids:
+            await query.message.reply_text("⚠️ No family members selected.")
+            return
+        
+        approve = data != "admin_reject_selected"
+        names = await self.storage.set_members_active(user_ids, approve)
+        self.pending_selection.clear()
+        
+        # Queue all notices in one go; the outbox delivers them concurrently within rate limits
+        notice = self.activation_notice if approve else self.removal_notice
+        await self.outbox.enqueue_many([(user_id, notice(name)) for user_id, name in names.items()])
+        
+        if approve:
+            summary = f"✅ **{len(names)} family members added!**\n\n"
+        else:
+            summary = f"❌ **{len(names)} family members rejected.**\n\n"
+        summary += "\n".join(f"• {name}" for name in names.values())
+        summary += "\n\n📱 They will be notified shortly."
+        
+        await query.message.reply_text(summary)
+        
+        pending_members = await self.storage.list_members(is_active=False)
+        await query.edit_message_reply_markup(reply_markup=self.build_pending_keyboard(pending_members))
+    
+    @staticmethod
+    def activation_notice(name: str) -> str:
+        """Message sent to a member when the admin activates them."""
+        return (
+            f"🎉 **Welcome to the family, {name}!**\n\n"
+            "You've been approved by the admin and can now use all bot features:\n\n"
+            "• Use `/survey` to plan your meals\n"
+            "• Receive weekly surveys automatically\n"
+            "• View your responses with `/my_responses`\n\n"
+            "Let's start planning your meals! 🍽️"
+        )
+    
+    @staticmethod
+    def removal_notice(name: str) -> str:
+        """Message sent to a member when the admin removes them."""
+        return (
+            f"👋 **Hello {name}**\n\n"
+            "You have been removed from the family meal planning group by the admin.\n\n"
+            "You will no longer receive:\n"
+            "• Weekly meal surveys\n"
+            "• Family meal planning updates\n"
+            "• Access to family features\n\n"
+            "If this was done in error, please contact the admin."
         )
     
     async def activate_family_member(self, query, data):
         """Activate a family member."""
-        logger.info(f"Activation callback received: {data}")
         user_id = int(data.split("_")[1])
-        logger.info(f"Extracted user_id: {user_id}")
-        
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE family_members SET is_active = 1 WHERE user_id = ?
-        ''', (user_id,))
+        logger.info("Activating family member %s", user_id, extra={'event': 'activate', 'user_id': user_id})
         
-        cursor.execute('''
-            SELECT first_name FROM family_members WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        name = result[0] if result else "Family Member"
-        
-        conn.commit()
-        conn.close()
+        name = await self.storage.set_member_active(user_id, True) or "Family Member"
         
         # Send confirmation to admin
         await query.message.reply_text(
@@ -795,38 +1283,13 @@ Let's plan the perfect week of meals! 🍳
         )
         
         # Notify the user that they've been activated
-        try:
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=f"🎉 **Welcome to the family, {name}!**\n\n"
-                     "You've been approved by the admin and can now use all bot features:\n\n"
-                     "• Use `/survey` to plan your meals\n"
-                     "• Receive weekly surveys automatically\n"
-                     "• View your responses with `/my_responses`\n\n"
-                     "Let's start planning your meals! 🍽️"
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify user {user_id} of activation: {e}")
+        await self.outbox.enqueue(user_id, self.activation_notice(name))
     
     async def deactivate_family_member(self, query, data):
         """Deactivate a family member."""
         user_id = int(data.split("_")[1])
         
-        conn = sqlite3.connect('meals_bot.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE family_members SET is_active = 0 WHERE user_id = ?
-        ''', (user_id,))
-        
-        cursor.execute('''
-            SELECT first_name FROM family_members WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        name = result[0] if result else "Family Member"
-        
-        conn.commit()
-        conn.close()
+        name = await self.storage.set_member_active(user_id, False) or "Family Member"
         
         # Send confirmation to admin
         await query.message.reply_text(
@@ -836,83 +1299,265 @@ Let's plan the perfect week of meals! 🍳
         )
         
         # Notify the user that they've been deactivated
-        try:
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=f"👋 **Hello {name}**\n\n"
-                     "You have been removed from the family meal planning group by the admin.\n\n"
-                     "You will no longer receive:\n"
-                     "• Weekly meal surveys\n"
-                     "• Family meal planning updates\n"
-                     "• Access to family features\n\n"
-                     "If this was done in error, please contact the admin."
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify user {user_id} of deactivation: {e}")
+        await self.outbox.enqueue(user_id, self.removal_notice(name))
+    
+    def local_now(self, timezone: Optional[str] = None) -> datetime:
+        """Get the current time in a timezone (server local time if none is configured)."""
+        timezone = timezone or self.default_timezone
+        return datetime.now(ZoneInfo(timezone)) if timezone else datetime.now()
     
-    def get_week_start(self) -> str:
-        """Get the start date of the current week (Monday)."""
-        today = datetime.now().date()
+    def get_week_start(self, timezone: Optional[str] = None) -> str:
+        """Get the start date of the current week (Monday) in the given timezone."""
+        today = self.local_now(timezone).date()
         days_since_monday = today.weekday()
         week_start = today - timedelta(days=days_since_monday)
         return week_start.strftime('%Y-%m-%d')
     
+    async def member_timezone(self, user_id: int) -> Optional[str]:
+        """Get a member's timezone, cached after the first lookup."""
+        if user_id not in self.timezones:
+            member = await self.storage.get_member(user_id)
+            self.timezones[user_id] = member['timezone'] if member else None
+        return self.timezones[user_id]
+    
+    async def user_week_start(self, user_id: int) -> str:
+        """Get the start date of the current week in the member's own timezone."""
+        return self.get_week_start(await self.member_timezone(user_id))
+    
+    def survey_slot(self, member: Dict, week_start: str) -> datetime:
+        """Get the local time a member's weekly survey is due, jittered across the spread window."""
+        hour, minute = map(int, (member['send_time'] or self.default_send_time).split(':'))
+        slot = datetime.strptime(week_start, '%Y-%m-%d').replace(hour=hour, minute=minute)
+        # Deterministic per member and week so restarts keep the same slot
+        jitter = random.Random(f"{member['user_id']}:{week_start}").uniform(0, self.survey_spread_minutes)
+        return slot + timedelta(minutes=jitter)
+    
+    @staticmethod
+    def previous_week_start(week_start: str) -> str:
+        """Get the start date of the week before the given week."""
+        previous = datetime.strptime(week_start, '%Y-%m-%d') - timedelta(days=7)
+        return previous.strftime('%Y-%m-%d')
+    
+    def ordered_responses(self, responses: Dict) -> List:
+        """Return (day, meal_type, response) tuples in calendar and meal order."""
+        ordered = []
+        for day in self.days:
+            for meal_type in self.meal_types:
+                if (day, meal_type) in responses:
+                    ordered.append((day, meal_type, responses[(day, meal_type)]))
+        return ordered
+    
+    @staticmethod
+    def display_name(member: Dict) -> str:
+        """Format a member's full name and username for admin views."""
+        name = f"{member['first_name']} {member['last_name']}" if member['last_name'] else member['first_name']
+        if member['username']:
+            name += f" (@{member['username']})"
+        return name
+    
+    async def send_weekly_survey(self):
+        """Queue weekly surveys for members whose local Monday slot is near, at most once per week."""
+        async with self.broadcast_lock:
+            if self.stopping:
+                return
+            if self.group_survey:
+                await self.post_weekly_group_survey()
+            else:
+                await self.queue_weekly_surveys()
+    
+    async def post_weekly_group_survey(self):
+        """Post the shared survey once per week, after the family's Monday send time."""
+        now = self.local_now(self.default_timezone).replace(tzinfo=None)
+        week_start = self.get_week_start(self.default_timezone)
+        hour, minute = map(int, self.default_send_time.split(':'))
+        if now.weekday() != 0 or now < datetime.strptime(week_start, '%Y-%m-%d').replace(hour=hour, minute=minute):
+            return
+        if await self.group_survey.posted_message(week_start):
+            return
+        message_id = await self.group_survey.post(self.application.bot, week_start)
+        logger.info("Posted group survey for week %s", week_start,
+                    extra={'event': 'group_survey_posted', 'message_id': message_id})
+    
+    def due_survey_week(self, member: Dict, now: datetime, lookahead: timedelta) -> Optional[str]:
+        """Return the week whose survey should be rendered for a member at local time `now`, if any.
+
+        A survey is due from `lookahead` before the member's Monday slot until
+        the end of that Monday, so a restart later on Monday still sends it.
+        """
+        # Near midnight on Sunday the look-ahead reaches into next week
+        for moment in (now, now + lookahead):
+            week_start = (moment.date() - timedelta(days=moment.weekday())).strftime('%Y-%m-%d')
+            if self.survey_slot(member, week_start) - lookahead <= now and \
+                    now.date() <= date.fromisoformat(week_start):
+                return week_start
+        return None
+    
+    async def queue_weekly_surveys(self):
+        """Pre-render the surveys due within the next SURVEY_PREWARM_MINUTES and queue each until its slot."""
+        active_members = await self.storage.list_members(is_active=True)
+        lookahead = timedelta(minutes=self.survey_prewarm_minutes)
+
+        due: Dict[str, List[Dict]] = {}
+        not_before: Dict[int, float] = {}
+        for member in active_members:
+            user_id = member['user_id']
+            self.timezones[user_id] = member['timezone']
+            try:
+                timezone = member['timezone'] or self.default_timezone
+                now = self.local_now(timezone).replace(tzinfo=None)
+                week_start = self.due_survey_week(member, now, lookahead)
+                if week_start is None or (week_start, user_id) in self.queued_surveys:
+                    continue
+                slot = self.survey_slot(member, week_start)
+                if timezone:
+                    slot = slot.replace(tzinfo=ZoneInfo(timezone))
+                # The outbox holds the rendered survey until the member's slot
+                not_before[user_id] = slot.timestamp()
+                due.setdefault(week_start, []).append(member)
+            except Exception as e:
+                logger.error("Failed to schedule weekly survey for user %s: %s", user_id, e)
+
+        for week_start, members in due.items():
+            if self.stopping:
+                break
+            try:
+                with self.tracer.trace('survey.prewarm', **{'survey.week_start': week_start}):
+                    # The dedup key makes a restarted run skip members already queued
+                    result = await self.queue_rendered_surveys(
+                        week_start, members, f"weekly_survey:{week_start}", not_before
+                    )
+            except Exception as e:
+                logger.error("Failed to queue weekly surveys for week %s: %s", week_start, e)
+                continue
+            self.queued_surveys.update((week_start, user_id) for user_id in result['user_ids'])
+            if not result['rendered']:
+                continue
+            logger.info(
+                "Pre-rendered %s weekly surveys for week %s in %.1f ms (%.1f ms rendering)",
+                result['rendered'], week_start,
+                result['load_ms'] + result['render_ms'] + result['enqueue_ms'], result['render_ms'],
+                extra={'event': 'survey_prewarm', 'week_start': week_start, 'rendered': result['rendered'],
+                       'queued': result['queued'], 'load_ms': round(result['load_ms'], 1),
+                       'render_ms': round(result['render_ms'], 1), 'enqueue_ms': round(result['enqueue_ms'], 1)}
+            )
+    
     def schedule_weekly_surveys(self):
-        """Schedule weekly surveys to be sent every Monday at 9:00 AM."""
+        """Check every minute for members whose weekly survey slot is within the pre-warm window."""
         def send_weekly_survey():
-            conn = sqlite3.connect('meals_bot.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT user_id FROM family_members WHERE is_active = 1
-            ''')
-            
-            active_members = cursor.fetchall()
-            conn.close()
-            
-            for (user_id,) in active_members:
-                try:
-                    # Use asyncio to run the async function
-                    import asyncio
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    loop.run_until_complete(self.send_meal_survey(user_id, user_id))
-                    loop.close()
-                except Exception as e:
-                    logger.error(f"Failed to send weekly survey to user {user_id}: {e}")
+            # Run on the bot's event loop so storage and the bot share connections
+            future = asyncio.run_coroutine_threadsafe(self.send_weekly_survey(), self.loop)
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("Weekly survey run failed: %s", e)
         
-        schedule.every().monday.at("09:00").do(send_weekly_survey)
-        logger.info("Weekly surveys scheduled for every Monday at 9:00 AM")
+        schedule.every().minute.do(send_weekly_survey)
+        logger.info(
+            "Weekly surveys scheduled for Mondays at each member's send time (default %s), spread over %s minutes "
+            "and rendered %s minutes ahead",
+            self.default_send_time, self.survey_spread_minutes, self.survey_prewarm_minutes
+        )
     
-    def run_scheduler(self):
-        """Run the scheduler in a separate thread."""
-        import threading
+    def schedule_backups(self):
+        """Back up the SQLite database every day at BACKUP_TIME (server time)."""
+        if not self.backups or not self.backup_time:
+            return
+        
+        def daily_backup():
+            future = asyncio.run_coroutine_threadsafe(self.run_backup(), self.loop)
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("Scheduled backup failed: %s", e)
         
+        schedule.every().day.at(self.backup_time).do(daily_backup)
+        logger.info("Database backups scheduled daily at %s into %s", self.backup_time, self.backups.directory)
+    
+    async def run_backup(self) -> Dict:
+        """Take an online backup in a thread so the bot keeps serving updates."""
+        with self.tracer.trace('backup'):
+            result = await asyncio.to_thread(self.backups.create)
+        logger.info(
+            "Backup written to %s (%.2f MB) in %.1fs", result['path'], result['bytes'] / 1e6, result['seconds'],
+            extra={'event': 'backup', 'steps': result['steps'], 'restarts': result['restarts'],
+                   'single_step': result['single_step']}
+        )
+        return result
+    
+    def schedule_headcount_reconciliation(self):
+        """Check live headcounts against the raw responses every HEADCOUNT_RECONCILE_MINUTES."""
+        if self.reconcile_minutes <= 0:
+            return
+        
+        def reconcile():
+            future = asyncio.run_coroutine_threadsafe(self.reconcile_headcounts(), self.loop)
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("Headcount reconciliation failed: %s", e)
+        
+        schedule.every(self.reconcile_minutes).minutes.do(reconcile)
+    
+    async def reconcile_headcounts(self, since_week: Optional[str] = None):
+        """Repair live headcounts that drifted from the responses, by default for recent weeks."""
+        if since_week is None:
+            since_week = (date.fromisoformat(self.get_week_start())
+                          - timedelta(weeks=self.reconcile_weeks)).isoformat()
+        drift = await self.storage.reconcile_headcounts(since_week)
+        if drift:
+            logger.warning(
+                "Repaired %s live headcounts that drifted from the responses", len(drift),
+                extra={'event': 'headcount_drift',
+                       'cells': {"/".join(key): {'live': live, 'actual': actual}
+                                 for key, (live, actual) in sorted(drift.items())[:50]}}
+            )
+        return drift
+    
+    def run_scheduler(self):
+        """Run the scheduler in a separate thread until shutdown."""
         def scheduler_loop():
-            while True:
+            while not self.scheduler_stop.is_set():
                 schedule.run_pending()
-                time.sleep(60)  # Check every minute
+                self.scheduler_stop.wait(60)  # Check every minute
         
         scheduler_thread = threading.Thread(target=scheduler_loop, daemon=True)
         scheduler_thread.start()
     
     def run_sync(self):
         """Run the bot synchronously for Railway deployment."""
-        self.application = Application.builder().token(self.bot_token).build()
+        self.application = (
+            Application.builder()
+            .token(self.bot_token)
+            .application_class(MealsApplication, kwargs={
+                'tracer': self.tracer,
+                'max_pending_per_user': int(os.getenv('USER_PENDING_UPDATES', 8)),
+            })
+            .concurrent_updates(int(os.getenv('CONCURRENT_UPDATES', 64)))
+            .request(TracedRequest(self.tracer, connection_pool_size=256))
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         
         # Add handlers
+        self.application.add_handler(TypeHandler(Update, self.drop_duplicate_updates), group=-1)
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("survey", self.survey_command))
         self.application.add_handler(CommandHandler("my_responses", self.my_responses_command))
+        self.application.add_handler(CommandHandler("timezone", self.timezone_command))
+        self.application.add_handler(CommandHandler("send_time", self.send_time_command))
         self.application.add_handler(CommandHandler("admin", self.admin_command))
+        self.application.add_handler(CommandHandler("profile", self.profile_command))
+        self.application.add_handler(CommandHandler("backup", self.backup_command))
         self.application.add_handler(CallbackQueryHandler(self.handle_callback_query))
+        self.application.add_handler(TypeHandler(Update, self.mark_update_processed), group=1)
         
         logger.info("MealsBot started successfully!")
-        logger.info("Weekly surveys will be sent every Monday at 9:00 AM")
         
         # Start Flask server in a separate thread for health checks
-        import threading
+        register_health_routes(app, self.health)
         flask_thread = threading.Thread(target=lambda: app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)), debug=False), daemon=True)
         flask_thread.start()
         
@@ -926,6 +1571,6 @@ if __name__ == "__main__":
         bot.run_sync()
             
     except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
+        logger.error("Failed to start bot: %s", e)
         import traceback
         traceback.print_exc()
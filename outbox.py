@@ -0,0 +1,201 @@
+"""
+Durable outbox for MealsBot's outgoing messages.
+
+Handlers enqueue messages into the storage outbox and return immediately.
+A single drain worker delivers them with retries, exponential backoff,
+dead-lettering and a shared rate limiter, so deliveries survive restarts.
+
+Messages can be queued fully rendered ahead of time with a not_before
+timestamp (see enqueue_rendered), so delivering them is only network I/O.
+Each drained batch logs how long was spent waiting on the rate limiter and
+how long sending.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from ratelimit import SendRateLimiter
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Queue outgoing messages in storage and deliver them in the background."""
+
+    def __init__(self, storage, rate_limiter: Optional[SendRateLimiter] = None, max_attempts: int = 5,
+                 base_delay: float = 2.0, max_delay: float = 600.0, batch_size: int = 50,
+                 poll_interval: float = 5.0, retention: float = 30 * 24 * 3600, close_grace: float = 5.0,
+                 tracer: Optional[Tracer] = None):
+        self.storage = storage
+        self.tracer = tracer or Tracer()
+        self.rate_limiter = rate_limiter or SendRateLimiter()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.close_grace = close_grace
+        self.bot = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+        self._draining = False
+        self._closing = False
+
+    async def enqueue(self, chat_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                      dedup_key: Optional[str] = None, not_before: float = 0.0) -> bool:
+        """Queue a message for delivery; returns False if dedup_key was already queued."""
+        markup_json = reply_markup.to_json() if reply_markup else None
+        queued = await self.storage.enqueue_outbox(chat_id, text, markup_json, dedup_key, not_before)
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    async def enqueue_many(self, messages: List[Tuple[int, str]]) -> int:
+        """Queue several (chat_id, text) messages in one storage transaction."""
+        queued = await self.storage.enqueue_outbox_many(
+            [{'chat_id': chat_id, 'text': text} for chat_id, text in messages]
+        )
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    async def enqueue_rendered(self, messages: List[Dict]) -> int:
+        """Queue pre-rendered messages in one storage transaction.
+
+        Each message is a dict of enqueue() arguments: chat_id, text and
+        optionally reply_markup, dedup_key and not_before.
+        """
+        queued = await self.storage.enqueue_outbox_many([
+            {**message, 'reply_markup': message['reply_markup'].to_json() if message.get('reply_markup') else None}
+            for message in messages
+        ])
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    def start(self, bot):
+        """Start the drain worker."""
+        self.bot = bot
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 0.0):
+        """Deliver due messages for up to `timeout` seconds, then stop; the rest stay queued in storage."""
+        if not self._task:
+            return
+        self._draining = True
+        self._wakeup.set()
+        done, _ = await asyncio.wait({self._task}, timeout=timeout)
+        if not done:
+            # Out of time: let sends already handed to Telegram finish so they
+            # are marked sent, and leave everything else queued
+            self._closing = True
+            done, _ = await asyncio.wait({self._task}, timeout=self.close_grace)
+        if not done:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def run(self):
+        """Drain the outbox until cancelled, or until nothing is due once stop() was called."""
+        while not self._closing:
+            try:
+                delivered = await self.drain_once()
+                await self._prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Outbox drain failed: %s", e)
+                delivered = 0
+
+            if delivered:
+                continue
+            if self._draining:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        """Deliver one batch of due messages concurrently and return how many were attempted."""
+        messages = await self.storage.due_outbox(time.time(), self.batch_size)
+        if messages:
+            started = time.perf_counter()
+            with self.tracer.trace('outbox.drain', **{'outbox.batch_size': len(messages)}) as span:
+                timings = await asyncio.gather(*(self._deliver(message) for message in messages))
+                sent = [timing for timing in timings if timing]
+                wait_ms = sum(wait for wait, _ in sent) * 1000
+                send_ms = sum(send for _, send in sent) * 1000
+                if span:
+                    span.set_attribute('outbox.sent', len(sent))
+                    span.set_attribute('outbox.send_ms', round(send_ms, 1))
+            if sent:
+                logger.info(
+                    "Delivered %s of %s outbox messages in %.0f ms (%.0f ms sending)",
+                    len(sent), len(messages), (time.perf_counter() - started) * 1000, send_ms,
+                    extra={'event': 'outbox_drain', 'sent': len(sent), 'batch_size': len(messages),
+                           'wait_ms': round(wait_ms, 1), 'send_ms': round(send_ms, 1)}
+                )
+        return len(messages)
+
+    async def _deliver(self, message) -> Optional[Tuple[float, float]]:
+        """Send one message; returns (rate limit wait, send) seconds if it was delivered."""
+        started = time.perf_counter()
+        await self.rate_limiter.acquire(message['chat_id'])
+        if self._closing:
+            return None
+        acquired = time.perf_counter()
+
+        reply_markup = None
+        if message['reply_markup']:
+            reply_markup = InlineKeyboardMarkup.de_json(json.loads(message['reply_markup']), self.bot)
+
+        attempts = message['attempts'] + 1
+        try:
+            await self.bot.send_message(
+                chat_id=message['chat_id'],
+                text=message['text'],
+                reply_markup=reply_markup
+            )
+        except (Forbidden, BadRequest) as e:
+            # The user blocked the bot or the message is invalid: retrying won't help
+            logger.error("Dead-lettering message %s to %s: %s", message['id'], message['chat_id'], e)
+            await self.storage.dead_letter_outbox(message['id'], attempts, str(e))
+            return None
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                logger.error("Dead-lettering message %s after %s attempts: %s", message['id'], attempts, e)
+                await self.storage.dead_letter_outbox(message['id'], attempts, str(e))
+                return None
+            if isinstance(e, RetryAfter):
+                delay = float(e.retry_after)
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                delay *= random.uniform(0.8, 1.2)
+            logger.warning("Retrying message %s in %.1fs: %s", message['id'], delay, e)
+            await self.storage.retry_outbox(message['id'], attempts, time.time() + delay, str(e))
+            return None
+        sent = time.perf_counter()
+
+        await self.storage.mark_outbox_sent(message['id'], time.time())
+        return acquired - started, sent - acquired
+
+    async def _prune(self):
+        now = time.time()
+        if now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        pruned = await self.storage.prune_outbox(now - self.retention)
+        if pruned:
+            logger.info("Pruned %s delivered outbox messages", pruned)
@@ -0,0 +1,66 @@
+"""
+On-demand profiling of the running bot.
+
+A cProfile profiler is created only when the admin asks for one and is
+attached to the event loop thread for a fixed window, so handlers, storage
+calls and Bot API requests that run during that window are measured under
+real traffic. Nothing is installed while no profile is running.
+"""
+
+import asyncio
+import cProfile
+import os
+import pstats
+from typing import Optional
+
+# Event loop plumbing: its cumulative time is mostly idle waiting in select()
+_LOOP_FILES = {'base_events.py', 'events.py'}
+_LOOP_BUILTINS = ("<method 'poll' of", "<method 'select' of", "<method 'run' of '_contextvars.Context'")
+
+
+def _is_loop_internal(filename: str, function: str) -> bool:
+    if filename == '~':
+        return function.startswith(_LOOP_BUILTINS)
+    directory, name = os.path.split(filename)
+    return name == 'selectors.py' or (name in _LOOP_FILES and os.path.basename(directory) == 'asyncio')
+
+
+class LiveProfiler:
+    """Profile the event loop thread for a limited number of seconds, one run at a time."""
+
+    def __init__(self, max_seconds: int = 300):
+        self.max_seconds = max_seconds
+        self.profile: Optional[cProfile.Profile] = None
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    async def run(self, seconds: float) -> cProfile.Profile:
+        """Collect profile data while the bot keeps serving updates for `seconds`."""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        profile = cProfile.Profile()
+        self.profile = profile
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self.profile = None
+        return profile
+
+    @staticmethod
+    def summarize(profile: cProfile.Profile, limit: int = 15) -> str:
+        """Render the top functions by cumulative time as plain text lines, skipping event loop internals."""
+        stats = pstats.Stats(profile)
+        rows = sorted(
+            (item for item in stats.stats.items() if not _is_loop_internal(item[0][0], item[0][2])),
+            key=lambda item: item[1][3], reverse=True
+        )
+
+        lines = [f"{'cum s':>8} {'own s':>8} {'calls':>7}  function"]
+        for (filename, line, function), (_, calls, own_time, cumulative, _) in rows[:limit]:
+            location = function if filename == '~' else f"{function} ({os.path.basename(filename)}:{line})"
+            lines.append(f"{cumulative:8.3f} {own_time:8.3f} {calls:7d}  {location}")
+        return "\n".join(lines)
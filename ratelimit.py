@@ -0,0 +1,116 @@
+"""
+Rate limiting helpers for MealsBot.
+
+TokenBucket is the basic building block. SendRateLimiter combines a global
+bucket with per-chat buckets to stay within Telegram's Bot API limits
+(about 30 messages per second overall and 1 per second per chat).
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if available without waiting."""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` will be available."""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until tokens are available and take them."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.wait_time(tokens))
+
+
+class SendRateLimiter:
+    """Shared limiter for outgoing Bot API messages (global + per chat)."""
+
+    def __init__(self, global_rate: float = 25.0, per_chat_rate: float = 1.0, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_chats = max_chats
+        self.chat_buckets: OrderedDict = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=1.0)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > self.max_chats:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        """Wait for a send slot for this chat."""
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+
+class CallbackThrottle:
+    """Per-user token buckets plus a global in-flight budget for callback queries.
+
+    Part of the in-flight budget is reserved for priority (admin) callbacks so
+    they are still served when ordinary survey taps saturate the bot.
+    """
+
+    def __init__(self, rate: float = 3.0, burst: float = 8.0, max_in_flight: int = 50,
+                 priority_reserved: int = 10, max_users: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.priority_reserved = min(priority_reserved, max_in_flight)
+        self.max_users = max_users
+        self.in_flight = 0
+        self.shed_count = 0
+        self.user_buckets: OrderedDict = OrderedDict()
+
+    def _user_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, capacity=self.burst)
+            self.user_buckets[user_id] = bucket
+            if len(self.user_buckets) > self.max_users:
+                self.user_buckets.popitem(last=False)
+        else:
+            self.user_buckets.move_to_end(user_id)
+        return bucket
+
+    def try_acquire(self, user_id: int, priority: bool = False) -> bool:
+        """Admit a callback and take an in-flight slot, or return False to shed it."""
+        limit = self.max_in_flight if priority else self.max_in_flight - self.priority_reserved
+        if self.in_flight >= limit or not self._user_bucket(user_id).try_acquire():
+            self.shed_count += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        """Return an in-flight slot taken by try_acquire."""
+        self.in_flight -= 1
@@ -0,0 +1,1417 @@
+"""
+Storage backends for MealsBot.
+
+All database access goes through a StorageBackend so the bot logic does not
+depend on a particular database. Three implementations are provided:
+
+- SQLiteStorage: the default, a tuned single-file SQLite database
+- InMemoryStorage: compact in-process state, useful for tests and benchmarks
+- PostgresStorage: optional, async pooled connections via asyncpg
+
+Use create_storage() to build the backend selected by the environment.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from survey_state import DAYS, MEAL_TYPES, Cell, MemberRecord, SurveyState
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = 'meals_bot.db'
+
+# (week_start, day, meal_type)
+HeadcountKey = Tuple[str, str, str]
+
+
+def headcount_drift(live: Dict[HeadcountKey, int], actual: Dict[HeadcountKey, int]) -> Dict[HeadcountKey, Tuple[int, int]]:
+    """Return (live, actual) for every counter that disagrees with the raw responses."""
+    drift = {}
+    for key in live.keys() | actual.keys():
+        if live.get(key, 0) != actual.get(key, 0):
+            drift[key] = (live.get(key, 0), actual.get(key, 0))
+    return drift
+
+
+class HeadcountMirror:
+    """In-memory copy of the week_headcounts table, keyed by (week_start, day, meal_type).
+
+    SQL backends copy in the counter rows each write leaves behind, so a
+    week's headcounts are read without touching the database. With
+    PostgreSQL two concurrent writes to one cell can be mirrored out of
+    order; reconcile_headcounts() repairs that.
+    """
+
+    def __init__(self, days: List[str] = DAYS, meal_types: List[str] = MEAL_TYPES):
+        self.cells: List[Cell] = [(day, meal_type) for day in days for meal_type in meal_types]
+        self.counts: Dict[HeadcountKey, int] = {}
+
+    def update(self, rows):
+        """Store (week_start, day, meal_type, count) rows."""
+        for week_start, day, meal_type, count in rows:
+            self.counts[(week_start, day, meal_type)] = count
+
+    def week(self, week_start: str) -> Dict[Cell, int]:
+        counts = {}
+        for cell in self.cells:
+            count = self.counts.get((week_start, *cell))
+            if count:
+                counts[cell] = count
+        return counts
+
+    def since(self, since_week: str) -> Dict[HeadcountKey, int]:
+        return {key: count for key, count in self.counts.items() if key[0] >= since_week and count}
+
+    def replace(self, since_week: str, counts: Dict[HeadcountKey, int]):
+        """Replace every counter from since_week on."""
+        self.counts = {key: count for key, count in self.counts.items() if key[0] < since_week}
+        self.counts.update(counts)
+
+
+class StorageBackend(ABC):
+    """Interface for members, meal responses, aggregates and scheduler state."""
+
+    name = "base"
+
+    # Incremented on every write that can change report contents
+    write_version = 0
+
+    async def initialize(self):
+        """Create tables and open connections."""
+
+    async def close(self):
+        """Release connections held by the backend."""
+
+    async def probe(self):
+        """Run a cheap query to check that the database responds."""
+        await self.get_state('health_probe')
+
+    # Family members
+
+    @abstractmethod
+    async def get_member(self, user_id: int) -> Optional[Dict]:
+        """Return a family member record, or None if the user is unknown."""
+
+    @abstractmethod
+    async def add_member(self, user_id: int, username: Optional[str], first_name: Optional[str],
+                         last_name: Optional[str], is_active: bool = False):
+        """Register a new family member (pending by default)."""
+
+    @abstractmethod
+    async def set_member_active(self, user_id: int, is_active: bool) -> Optional[str]:
+        """Activate or deactivate a member and return their first name."""
+
+    @abstractmethod
+    async def set_member_preferences(self, user_id: int, timezone: Optional[str] = None,
+                                     send_time: Optional[str] = None):
+        """Update a member's timezone and/or preferred survey time (None leaves a field unchanged)."""
+
+    @abstractmethod
+    async def set_members_active(self, user_ids: List[int], is_active: bool) -> Dict[int, str]:
+        """Activate or deactivate many members in one transaction and return their first names."""
+
+    @abstractmethod
+    async def list_members(self, is_active: Optional[bool] = None) -> List[Dict]:
+        """List members, active first and then by first name."""
+
+    async def get_first_name(self, user_id: int) -> Optional[str]:
+        """Return a member's first name, or None if the user is unknown."""
+        member = await self.get_member(user_id)
+        return member['first_name'] if member else None
+
+    # Meal responses
+
+    @abstractmethod
+    async def get_responses(self, user_id: int, week_start: str) -> Dict[Cell, bool]:
+        """Return a user's responses for a week keyed by (day, meal_type)."""
+
+    @abstractmethod
+    async def toggle_response(self, user_id: int, week_start: str, day: str, meal_type: str) -> bool:
+        """Flip a single response (missing counts as unselected) and return the new value."""
+
+    @abstractmethod
+    async def set_response(self, user_id: int, week_start: str, day: str, meal_type: str,
+                           response: bool) -> bool:
+        """Set a single response and return True if the stored value changed."""
+
+    @abstractmethod
+    async def set_responses(self, user_id: int, week_start: str, cells: List[Cell], response: bool):
+        """Set many cells of a user's week to the same value in one transaction."""
+
+    @abstractmethod
+    async def copy_week_responses(self, user_id: int, from_week: str, to_week: str):
+        """Replace a user's responses for to_week with a copy of from_week in one transaction."""
+
+    @abstractmethod
+    async def clear_week_responses(self, user_id: int, week_start: str):
+        """Remove all of a user's responses for a week."""
+
+    async def count_responses(self, user_id: int, week_start: str) -> int:
+        """Return how many meals a user has selected for a week."""
+        return sum((await self.get_responses(user_id, week_start)).values())
+
+    # Aggregates
+
+    @abstractmethod
+    async def week_responses(self, week_start: str) -> Dict[int, Dict[Cell, bool]]:
+        """Return every user's responses for a week keyed by user id."""
+
+    @abstractmethod
+    async def week_headcounts(self, week_start: str) -> Dict[Cell, int]:
+        """Return the number of selected meals per (day, meal_type) for a week from live counters."""
+
+    @abstractmethod
+    async def reconcile_headcounts(self, since_week: str) -> Dict[HeadcountKey, Tuple[int, int]]:
+        """Check live headcounts from since_week on against the raw responses and repair any drift.
+
+        Returns (live, actual) for each (week_start, day, meal_type) that was wrong.
+        """
+
+    @abstractmethod
+    async def responses_between(self, first_week: str, last_week: str) -> List[Tuple[str, int, str, str, bool]]:
+        """Return (week_start, user_id, day, meal_type, response) for every response in a range of weeks."""
+
+    async def report_snapshot(self, week_start: str) -> Dict:
+        """Return active members, responses and headcounts for a week from one consistent snapshot."""
+        return {
+            'members': await self.list_members(is_active=True),
+            'responses': await self.week_responses(week_start),
+            'headcounts': await self.week_headcounts(week_start),
+        }
+
+    # Scheduler state
+
+    @abstractmethod
+    async def get_state(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Read a persisted scheduler/bot state value."""
+
+    @abstractmethod
+    async def set_state(self, key: str, value: str):
+        """Persist a scheduler/bot state value."""
+
+    # Outbox
+
+    @abstractmethod
+    async def enqueue_outbox(self, chat_id: int, text: str, reply_markup: Optional[str] = None,
+                             dedup_key: Optional[str] = None, not_before: float = 0.0) -> bool:
+        """Queue an outgoing message; returns False if dedup_key was already queued."""
+
+    async def enqueue_outbox_many(self, messages: List[Dict]) -> int:
+        """Queue several messages (dicts of enqueue_outbox arguments); returns how many were queued."""
+        queued = 0
+        for message in messages:
+            queued += await self.enqueue_outbox(**message)
+        return queued
+
+    @abstractmethod
+    async def due_outbox(self, now: float, limit: int) -> List[Dict]:
+        """Return pending messages whose next attempt is due, oldest first."""
+
+    @abstractmethod
+    async def mark_outbox_sent(self, message_id: int, sent_at: float):
+        """Mark a queued message as delivered."""
+
+    @abstractmethod
+    async def retry_outbox(self, message_id: int, attempts: int, next_attempt_at: float, error: str):
+        """Record a failed attempt and schedule the next one."""
+
+    @abstractmethod
+    async def dead_letter_outbox(self, message_id: int, attempts: int, error: str):
+        """Give up on a message and keep it for inspection."""
+
+    @abstractmethod
+    async def outbox_depth(self) -> int:
+        """Return the number of messages still waiting to be delivered."""
+
+    @abstractmethod
+    async def prune_outbox(self, sent_before: float) -> int:
+        """Delete delivered messages sent before the given time."""
+
+
+class InMemoryStorage(StorageBackend):
+    """Storage kept entirely in process memory; nothing survives a restart.
+
+    Members and responses live in a compact SurveyState (slotted member
+    records and per-week bitmask arrays) rather than nested dicts.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.survey = SurveyState()
+        self.state: Dict[str, str] = {}
+        self.outbox: Dict[int, Dict] = {}
+        self.outbox_keys: Dict[str, int] = {}
+        self.next_outbox_id = 1
+
+    async def get_member(self, user_id):
+        member = self.survey.members.get(user_id)
+        return member.as_dict() if member else None
+
+    async def add_member(self, user_id, username, first_name, last_name, is_active=False):
+        # Like INSERT OR IGNORE: an existing member keeps its status and preferences
+        if user_id in self.survey.members:
+            return
+        self.write_version += 1
+        self.survey.add_member(MemberRecord(user_id, username, first_name, last_name, bool(is_active)))
+
+    async def set_member_preferences(self, user_id, timezone=None, send_time=None):
+        member = self.survey.members.get(user_id)
+        if member:
+            if timezone is not None:
+                member.timezone = timezone
+            if send_time is not None:
+                member.send_time = send_time
+
+    async def set_member_active(self, user_id, is_active):
+        self.write_version += 1
+        member = self.survey.members.get(user_id)
+        if not member:
+            return None
+        member.is_active = bool(is_active)
+        return member.first_name
+
+    async def set_members_active(self, user_ids, is_active):
+        self.write_version += 1
+        names = {}
+        for user_id in user_ids:
+            member = self.survey.members.get(user_id)
+            if member:
+                member.is_active = bool(is_active)
+                names[user_id] = member.first_name
+        return names
+
+    async def list_members(self, is_active=None):
+        members = [m.as_dict() for m in self.survey.members.values()
+                   if is_active is None or m.is_active == bool(is_active)]
+        members.sort(key=lambda m: (not m['is_active'], m['first_name'] or ''))
+        return members
+
+    async def get_responses(self, user_id, week_start):
+        return self.survey.get(user_id, week_start)
+
+    async def toggle_response(self, user_id, week_start, day, meal_type):
+        self.write_version += 1
+        return self.survey.toggle(user_id, week_start, (day, meal_type))
+
+    async def set_response(self, user_id, week_start, day, meal_type, response):
+        self.write_version += 1
+        return self.survey.set(user_id, week_start, [(day, meal_type)], bool(response))
+
+    async def set_responses(self, user_id, week_start, cells, response):
+        self.write_version += 1
+        self.survey.set(user_id, week_start, cells, bool(response))
+
+    async def copy_week_responses(self, user_id, from_week, to_week):
+        self.write_version += 1
+        self.survey.copy(user_id, from_week, to_week)
+
+    async def clear_week_responses(self, user_id, week_start):
+        self.write_version += 1
+        self.survey.clear(user_id, week_start)
+
+    async def count_responses(self, user_id, week_start):
+        return self.survey.count(user_id, week_start)
+
+    async def week_responses(self, week_start):
+        decode = self.survey.grid.decode
+        return {user_id: decode(answered, selected)
+                for user_id, answered, selected in self.survey.week_members(week_start)}
+
+    async def week_headcounts(self, week_start):
+        return self.survey.headcounts(week_start)
+
+    async def reconcile_headcounts(self, since_week):
+        cells = self.survey.grid.cells
+        drift = {}
+        for week_start, week in self.survey.weeks.items():
+            if week_start < since_week:
+                continue
+            actual = self.survey.count_selected(week_start)
+            for index, (live, count) in enumerate(zip(week.counts, actual)):
+                if live != count:
+                    drift[(week_start, *cells[index])] = (live, count)
+                    week.counts[index] = count
+        if drift:
+            self.write_version += 1
+        return drift
+
+    async def responses_between(self, first_week, last_week):
+        decode = self.survey.grid.decode
+        rows = []
+        for week_start in self.survey.weeks:
+            if first_week <= week_start <= last_week:
+                for user_id, answered, selected in self.survey.week_members(week_start):
+                    rows.extend((week_start, user_id, day, meal_type, response)
+                                for (day, meal_type), response in decode(answered, selected).items())
+        return rows
+
+    async def get_state(self, key, default=None):
+        return self.state.get(key, default)
+
+    async def set_state(self, key, value):
+        self.state[key] = value
+
+    async def enqueue_outbox(self, chat_id, text, reply_markup=None, dedup_key=None, not_before=0.0):
+        if dedup_key is not None and dedup_key in self.outbox_keys:
+            return False
+        message_id = self.next_outbox_id
+        self.next_outbox_id += 1
+        self.outbox[message_id] = {
+            'id': message_id,
+            'chat_id': chat_id,
+            'text': text,
+            'reply_markup': reply_markup,
+            'dedup_key': dedup_key,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': not_before,
+            'last_error': None,
+            'sent_at': None,
+        }
+        if dedup_key is not None:
+            self.outbox_keys[dedup_key] = message_id
+        return True
+
+    async def due_outbox(self, now, limit):
+        due = [dict(m) for m in self.outbox.values()
+               if m['status'] == 'pending' and m['next_attempt_at'] <= now]
+        due.sort(key=lambda m: (m['next_attempt_at'], m['id']))
+        return due[:limit]
+
+    async def mark_outbox_sent(self, message_id, sent_at):
+        self.outbox[message_id].update(status='sent', sent_at=sent_at)
+
+    async def retry_outbox(self, message_id, attempts, next_attempt_at, error):
+        self.outbox[message_id].update(attempts=attempts, next_attempt_at=next_attempt_at, last_error=error)
+
+    async def dead_letter_outbox(self, message_id, attempts, error):
+        self.outbox[message_id].update(status='dead', attempts=attempts, last_error=error)
+
+    async def outbox_depth(self):
+        return sum(1 for m in self.outbox.values() if m['status'] == 'pending')
+
+    async def prune_outbox(self, sent_before):
+        pruned = [m for m in self.outbox.values()
+                  if m['status'] == 'sent' and m['sent_at'] < sent_before]
+        for message in pruned:
+            del self.outbox[message['id']]
+            if message['dedup_key'] is not None:
+                del self.outbox_keys[message['dedup_key']]
+        return len(pruned)
+
+
+class SQLiteStorage(StorageBackend):
+    """SQLite storage using one long-lived, tuned connection."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = DEFAULT_DATABASE_PATH):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.report_conn: Optional[sqlite3.Connection] = None
+        self.report_lock = threading.Lock()
+        self.probe_conn: Optional[sqlite3.Connection] = None
+        self.probe_lock = threading.Lock()
+        self.headcounts = HeadcountMirror()
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection with the pragmas used throughout the bot."""
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        if self.path != ':memory:':
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-8000')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    async def initialize(self):
+        self.conn = self.connect()
+        cursor = self.conn.cursor()
+
+        # Create family members table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS family_members (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+
+        # Add per-member delivery preferences to older databases
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(family_members)')}
+        if 'timezone' not in columns:
+            cursor.execute('ALTER TABLE family_members ADD COLUMN timezone TEXT')
+        if 'send_time' not in columns:
+            cursor.execute('ALTER TABLE family_members ADD COLUMN send_time TEXT')
+
+        # Create meal responses table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS meal_responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                week_start DATE,
+                meal_type TEXT,
+                day TEXT,
+                response BOOLEAN,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES family_members (user_id)
+            )
+        ''')
+
+        # Older databases may hold duplicate cells; keep the latest before indexing
+        cursor.execute('''
+            DELETE FROM meal_responses WHERE id NOT IN (
+                SELECT MAX(id) FROM meal_responses
+                GROUP BY user_id, week_start, day, meal_type
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_meal_responses_cell
+            ON meal_responses (user_id, week_start, day, meal_type)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_meal_responses_week
+            ON meal_responses (week_start, day, meal_type, response)
+        ''')
+
+        # Live headcounts, kept in step with meal_responses by triggers in the same transaction
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS week_headcounts (
+                week_start DATE,
+                day TEXT,
+                meal_type TEXT,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (week_start, day, meal_type)
+            ) WITHOUT ROWID
+        ''')
+        if not cursor.execute('SELECT 1 FROM week_headcounts LIMIT 1').fetchone():
+            cursor.execute('''
+                INSERT INTO week_headcounts (week_start, day, meal_type, count)
+                SELECT week_start, day, meal_type, COUNT(*)
+                FROM meal_responses
+                WHERE response = 1
+                GROUP BY week_start, day, meal_type
+            ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS meal_responses_count_insert
+            AFTER INSERT ON meal_responses WHEN NEW.response
+            BEGIN
+                INSERT INTO week_headcounts (week_start, day, meal_type, count)
+                VALUES (NEW.week_start, NEW.day, NEW.meal_type, 1)
+                ON CONFLICT (week_start, day, meal_type) DO UPDATE SET count = count + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS meal_responses_count_update
+            AFTER UPDATE OF response ON meal_responses WHEN OLD.response IS NOT NEW.response
+            BEGIN
+                INSERT INTO week_headcounts (week_start, day, meal_type, count)
+                VALUES (NEW.week_start, NEW.day, NEW.meal_type, CASE WHEN NEW.response THEN 1 ELSE -1 END)
+                ON CONFLICT (week_start, day, meal_type) DO UPDATE SET count = count + excluded.count;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS meal_responses_count_delete
+            AFTER DELETE ON meal_responses WHEN OLD.response
+            BEGIN
+                UPDATE week_headcounts SET count = count - 1
+                WHERE week_start = OLD.week_start AND day = OLD.day AND meal_type = OLD.meal_type;
+            END
+        ''')
+
+        # Create scheduler state table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduler_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        # Create outbox table for outgoing messages
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                reply_markup TEXT,
+                dedup_key TEXT UNIQUE,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                sent_at REAL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_due
+            ON outbox (status, next_attempt_at)
+        ''')
+
+        self.conn.commit()
+        self.headcounts.update(self.conn.execute('SELECT week_start, day, meal_type, count FROM week_headcounts'))
+
+    def _read_headcounts(self, week_start: str, cell: Optional[Cell] = None) -> List[Tuple]:
+        """Read counter rows for a week (or one cell) inside the current write transaction."""
+        if cell:
+            return self.conn.execute('''
+                SELECT week_start, day, meal_type, count FROM week_headcounts
+                WHERE week_start = ? AND day = ? AND meal_type = ?
+            ''', (week_start, *cell)).fetchall()
+        return self.conn.execute('''
+            SELECT week_start, day, meal_type, count FROM week_headcounts WHERE week_start = ?
+        ''', (week_start,)).fetchall()
+
+    async def close(self):
+        if self.report_conn:
+            self.report_conn.close()
+            self.report_conn = None
+        if self.probe_conn:
+            self.probe_conn.close()
+            self.probe_conn = None
+        if self.conn and self.path != ':memory:':
+            # Fold the WAL back into the database file so a restart starts clean
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def connect_read_only(self) -> sqlite3.Connection:
+        """Open a read-only connection for reports; in WAL mode it never blocks writers."""
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=5.0,
+                               check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA query_only=1')
+        conn.execute('PRAGMA cache_size=-8000')
+        return conn
+
+    def _read_snapshot(self, week_start: str) -> Dict:
+        with self.report_lock:
+            if self.report_conn is None:
+                self.report_conn = self.connect_read_only()
+            conn = self.report_conn
+            # One read transaction so every query sees the same WAL snapshot
+            conn.execute('BEGIN')
+            try:
+                members = [self._member_row(row) for row in conn.execute('''
+                    SELECT user_id, username, first_name, last_name, is_active, timezone, send_time
+                    FROM family_members
+                    WHERE is_active = 1
+                    ORDER BY first_name
+                ''')]
+                responses: Dict[int, Dict[Cell, bool]] = {}
+                headcounts: Dict[Cell, int] = {}
+                rows = conn.execute('''
+                    SELECT user_id, day, meal_type, response
+                    FROM meal_responses
+                    WHERE week_start = ?
+                ''', (week_start,))
+                for user_id, day, meal_type, response in rows:
+                    responses.setdefault(user_id, {})[(day, meal_type)] = bool(response)
+                    if response:
+                        headcounts[(day, meal_type)] = headcounts.get((day, meal_type), 0) + 1
+            finally:
+                conn.execute('COMMIT')
+        return {'members': members, 'responses': responses, 'headcounts': headcounts}
+
+    def _read_responses_between(self, first_week: str, last_week: str) -> List[Tuple[str, int, str, str, bool]]:
+        with self.report_lock:
+            if self.report_conn is None:
+                self.report_conn = self.connect_read_only()
+            return self.report_conn.execute('''
+                SELECT week_start, user_id, day, meal_type, response
+                FROM meal_responses
+                WHERE week_start BETWEEN ? AND ?
+            ''', (first_week, last_week)).fetchall()
+
+    def _probe(self):
+        with self.probe_lock:
+            if self.probe_conn is None:
+                # Read-only, so the probe never competes with the bot's writes
+                self.probe_conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=5.0,
+                                                  check_same_thread=False)
+            self.probe_conn.execute('SELECT 1 FROM scheduler_state LIMIT 1').fetchall()
+
+    async def probe(self):
+        if self.path == ':memory:':
+            self.conn.execute('SELECT 1').fetchone()
+            return
+        await asyncio.to_thread(self._probe)
+
+    async def report_snapshot(self, week_start):
+        if self.path == ':memory:':
+            return await super().report_snapshot(week_start)
+        # Run off the event loop so large reports never delay toggles
+        return await asyncio.to_thread(self._read_snapshot, week_start)
+
+    async def responses_between(self, first_week, last_week):
+        if self.path == ':memory:':
+            return self.conn.execute('''
+                SELECT week_start, user_id, day, meal_type, response
+                FROM meal_responses
+                WHERE week_start BETWEEN ? AND ?
+            ''', (first_week, last_week)).fetchall()
+        # Months of history is a large read, so keep it off the event loop
+        return await asyncio.to_thread(self._read_responses_between, first_week, last_week)
+
+    @staticmethod
+    def _member_row(row) -> Dict:
+        user_id, username, first_name, last_name, is_active, timezone, send_time = row
+        return {
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'is_active': bool(is_active),
+            'timezone': timezone,
+            'send_time': send_time,
+        }
+
+    async def get_member(self, user_id):
+        row = self.conn.execute('''
+            SELECT user_id, username, first_name, last_name, is_active, timezone, send_time
+            FROM family_members WHERE user_id = ?
+        ''', (user_id,)).fetchone()
+        return self._member_row(row) if row else None
+
+    async def add_member(self, user_id, username, first_name, last_name, is_active=False):
+        self.write_version += 1
+        with self.conn:
+            self.conn.execute('''
+                INSERT OR IGNORE INTO family_members (user_id, username, first_name, last_name, is_active)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name, int(bool(is_active))))
+
+    async def set_member_active(self, user_id, is_active):
+        self.write_version += 1
+        with self.conn:
+            self.conn.execute('''
+                UPDATE family_members SET is_active = ? WHERE user_id = ?
+            ''', (int(bool(is_active)), user_id))
+            row = self.conn.execute('''
+                SELECT first_name FROM family_members WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    async def set_member_preferences(self, user_id, timezone=None, send_time=None):
+        with self.conn:
+            self.conn.execute('''
+                UPDATE family_members
+                SET timezone = COALESCE(?, timezone), send_time = COALESCE(?, send_time)
+                WHERE user_id = ?
+            ''', (timezone, send_time, user_id))
+
+    async def set_members_active(self, user_ids, is_active):
+        self.write_version += 1
+        if not user_ids:
+            return {}
+        placeholders = ', '.join('?' for _ in user_ids)
+        with self.conn:
+            self.conn.execute(f'''
+                UPDATE family_members SET is_active = ? WHERE user_id IN ({placeholders})
+            ''', (int(bool(is_active)), *user_ids))
+            rows = self.conn.execute(f'''
+                SELECT user_id, first_name FROM family_members WHERE user_id IN ({placeholders})
+            ''', tuple(user_ids)).fetchall()
+        return dict(rows)
+
+    async def list_members(self, is_active=None):
+        query = '''
+            SELECT user_id, username, first_name, last_name, is_active, timezone, send_time
+            FROM family_members
+        '''
+        params: tuple = ()
+        if is_active is not None:
+            query += ' WHERE is_active = ?'
+            params = (int(bool(is_active)),)
+        query += ' ORDER BY is_active DESC, first_name'
+        return [self._member_row(row) for row in self.conn.execute(query, params)]
+
+    async def get_first_name(self, user_id):
+        row = self.conn.execute('''
+            SELECT first_name FROM family_members WHERE user_id = ?
+        ''', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    async def get_responses(self, user_id, week_start):
+        rows = self.conn.execute('''
+            SELECT day, meal_type, response
+            FROM meal_responses
+            WHERE user_id = ? AND week_start = ?
+        ''', (user_id, week_start))
+        return {(day, meal_type): bool(response) for day, meal_type, response in rows}
+
+    async def toggle_response(self, user_id, week_start, day, meal_type):
+        self.write_version += 1
+        with self.conn:
+            self.conn.execute('''
+                INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT (user_id, week_start, day, meal_type)
+                DO UPDATE SET response = NOT response, timestamp = CURRENT_TIMESTAMP
+            ''', (user_id, week_start, meal_type, day))
+            row = self.conn.execute('''
+                SELECT response FROM meal_responses
+                WHERE user_id = ? AND week_start = ? AND day = ? AND meal_type = ?
+            ''', (user_id, week_start, day, meal_type)).fetchone()
+            counts = self._read_headcounts(week_start, (day, meal_type))
+        # Only mirror what was committed
+        self.headcounts.update(counts)
+        return bool(row[0])
+
+    async def set_response(self, user_id, week_start, day, meal_type, response):
+        self.write_version += 1
+        with self.conn:
+            cursor = self.conn.execute('''
+                INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, week_start, day, meal_type)
+                DO UPDATE SET response = excluded.response, timestamp = CURRENT_TIMESTAMP
+                WHERE response IS NOT excluded.response
+            ''', (user_id, week_start, meal_type, day, int(bool(response))))
+            changed = cursor.rowcount > 0
+            counts = self._read_headcounts(week_start, (day, meal_type)) if changed else []
+        self.headcounts.update(counts)
+        return changed
+
+    async def set_responses(self, user_id, week_start, cells, response):
+        self.write_version += 1
+        with self.conn:
+            self.conn.executemany('''
+                INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, week_start, day, meal_type)
+                DO UPDATE SET response = excluded.response, timestamp = CURRENT_TIMESTAMP
+                WHERE response IS NOT excluded.response
+            ''', [(user_id, week_start, meal_type, day, int(bool(response))) for day, meal_type in cells])
+            counts = self._read_headcounts(week_start)
+        self.headcounts.update(counts)
+
+    async def copy_week_responses(self, user_id, from_week, to_week):
+        self.write_version += 1
+        with self.conn:
+            self.conn.execute('''
+                DELETE FROM meal_responses WHERE user_id = ? AND week_start = ?
+            ''', (user_id, to_week))
+            self.conn.execute('''
+                INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                SELECT user_id, ?, meal_type, day, response
+                FROM meal_responses
+                WHERE user_id = ? AND week_start = ?
+            ''', (to_week, user_id, from_week))
+            counts = self._read_headcounts(to_week)
+        self.headcounts.update(counts)
+
+    async def clear_week_responses(self, user_id, week_start):
+        self.write_version += 1
+        with self.conn:
+            self.conn.execute('''
+                DELETE FROM meal_responses WHERE user_id = ? AND week_start = ?
+            ''', (user_id, week_start))
+            counts = self._read_headcounts(week_start)
+        self.headcounts.update(counts)
+
+    async def count_responses(self, user_id, week_start):
+        return self.conn.execute('''
+            SELECT COUNT(*) FROM meal_responses
+            WHERE user_id = ? AND week_start = ? AND response
+        ''', (user_id, week_start)).fetchone()[0]
+
+    async def week_responses(self, week_start):
+        responses: Dict[int, Dict[Cell, bool]] = {}
+        rows = self.conn.execute('''
+            SELECT user_id, day, meal_type, response
+            FROM meal_responses
+            WHERE week_start = ?
+        ''', (week_start,))
+        for user_id, day, meal_type, response in rows:
+            responses.setdefault(user_id, {})[(day, meal_type)] = bool(response)
+        return responses
+
+    async def week_headcounts(self, week_start):
+        return self.headcounts.week(week_start)
+
+    async def reconcile_headcounts(self, since_week):
+        # On the bot's connection and thread, so no write lands between the reads and the repair
+        with self.conn:
+            actual = {(week_start, day, meal_type): count for week_start, day, meal_type, count in self.conn.execute('''
+                SELECT week_start, day, meal_type, COUNT(*)
+                FROM meal_responses
+                WHERE week_start >= ? AND response = 1
+                GROUP BY week_start, day, meal_type
+            ''', (since_week,))}
+            stored = {(week_start, day, meal_type): count for week_start, day, meal_type, count in self.conn.execute('''
+                SELECT week_start, day, meal_type, count FROM week_headcounts
+                WHERE week_start >= ? AND count != 0
+            ''', (since_week,))}
+            table_drift = headcount_drift(stored, actual)
+            self.conn.executemany('''
+                INSERT INTO week_headcounts (week_start, day, meal_type, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT (week_start, day, meal_type) DO UPDATE SET count = excluded.count
+            ''', [(*key, count) for key, (_, count) in table_drift.items()])
+        drift = {**headcount_drift(self.headcounts.since(since_week), actual), **table_drift}
+        self.headcounts.replace(since_week, actual)
+        if drift:
+            self.write_version += 1
+        return drift
+
+    async def get_state(self, key, default=None):
+        row = self.conn.execute('''
+            SELECT value FROM scheduler_state WHERE key = ?
+        ''', (key,)).fetchone()
+        return row[0] if row else default
+
+    async def set_state(self, key, value):
+        with self.conn:
+            self.conn.execute('''
+                INSERT INTO scheduler_state (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            ''', (key, value))
+
+    @staticmethod
+    def _outbox_row(row) -> Dict:
+        message_id, chat_id, text, reply_markup, dedup_key, attempts, next_attempt_at = row
+        return {
+            'id': message_id,
+            'chat_id': chat_id,
+            'text': text,
+            'reply_markup': reply_markup,
+            'dedup_key': dedup_key,
+            'attempts': attempts,
+            'next_attempt_at': next_attempt_at,
+        }
+
+    async def enqueue_outbox(self, chat_id, text, reply_markup=None, dedup_key=None, not_before=0.0):
+        with self.conn:
+            cursor = self.conn.execute('''
+                INSERT OR IGNORE INTO outbox (chat_id, text, reply_markup, dedup_key, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (chat_id, text, reply_markup, dedup_key, not_before))
+        return cursor.rowcount > 0
+
+    async def enqueue_outbox_many(self, messages):
+        queued = 0
+        with self.conn:
+            for message in messages:
+                cursor = self.conn.execute('''
+                    INSERT OR IGNORE INTO outbox (chat_id, text, reply_markup, dedup_key, next_attempt_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (message['chat_id'], message['text'], message.get('reply_markup'),
+                      message.get('dedup_key'), message.get('not_before', 0.0)))
+                queued += cursor.rowcount
+        return queued
+
+    async def due_outbox(self, now, limit):
+        rows = self.conn.execute('''
+            SELECT id, chat_id, text, reply_markup, dedup_key, attempts, next_attempt_at
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        ''', (now, limit))
+        return [self._outbox_row(row) for row in rows]
+
+    async def mark_outbox_sent(self, message_id, sent_at):
+        with self.conn:
+            self.conn.execute('''
+                UPDATE outbox SET status = 'sent', sent_at = ? WHERE id = ?
+            ''', (sent_at, message_id))
+
+    async def retry_outbox(self, message_id, attempts, next_attempt_at, error):
+        with self.conn:
+            self.conn.execute('''
+                UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?
+            ''', (attempts, next_attempt_at, error, message_id))
+
+    async def dead_letter_outbox(self, message_id, attempts, error):
+        with self.conn:
+            self.conn.execute('''
+                UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?
+            ''', (attempts, error, message_id))
+
+    async def outbox_depth(self):
+        return self.conn.execute('''
+            SELECT COUNT(*) FROM outbox WHERE status = 'pending'
+        ''').fetchone()[0]
+
+    async def prune_outbox(self, sent_before):
+        with self.conn:
+            cursor = self.conn.execute('''
+                DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?
+            ''', (sent_before,))
+        return cursor.rowcount
+
+
+class PostgresStorage(StorageBackend):
+    """PostgreSQL storage using an asyncpg connection pool (requires `pip install asyncpg`)."""
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self.headcounts = HeadcountMirror()
+
+    async def initialize(self):
+        try:
+            import asyncpg
+        except ImportError as e:
+            raise RuntimeError("PostgreSQL storage requires asyncpg: pip install asyncpg") from e
+
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS family_members (
+                    user_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    is_active BOOLEAN DEFAULT TRUE
+                )
+            ''')
+            await conn.execute('''
+                ALTER TABLE family_members
+                ADD COLUMN IF NOT EXISTS timezone TEXT,
+                ADD COLUMN IF NOT EXISTS send_time TEXT
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS meal_responses (
+                    id BIGSERIAL PRIMARY KEY,
+                    user_id BIGINT REFERENCES family_members (user_id),
+                    week_start TEXT,
+                    meal_type TEXT,
+                    day TEXT,
+                    response BOOLEAN,
+                    timestamp TIMESTAMPTZ DEFAULT now(),
+                    UNIQUE (user_id, week_start, day, meal_type)
+                )
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_meal_responses_week
+                ON meal_responses (week_start, day, meal_type, response)
+            ''')
+            # Live headcounts, kept in step with meal_responses by a trigger in the same transaction
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS week_headcounts (
+                    week_start TEXT,
+                    day TEXT,
+                    meal_type TEXT,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (week_start, day, meal_type)
+                )
+            ''')
+            await conn.execute('''
+                CREATE OR REPLACE FUNCTION meal_responses_count() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'UPDATE' AND OLD.response IS NOT DISTINCT FROM NEW.response THEN
+                        RETURN NULL;
+                    END IF;
+                    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.response THEN
+                        UPDATE week_headcounts SET count = count - 1
+                        WHERE week_start = OLD.week_start AND day = OLD.day AND meal_type = OLD.meal_type;
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.response THEN
+                        INSERT INTO week_headcounts (week_start, day, meal_type, count)
+                        VALUES (NEW.week_start, NEW.day, NEW.meal_type, 1)
+                        ON CONFLICT (week_start, day, meal_type) DO UPDATE SET count = week_headcounts.count + 1;
+                    END IF;
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql
+            ''')
+            async with conn.transaction():
+                # Backfill existing responses once, before the trigger starts counting
+                await conn.execute('LOCK TABLE meal_responses IN SHARE ROW EXCLUSIVE MODE')
+                exists = await conn.fetchval('''
+                    SELECT 1 FROM pg_trigger WHERE tgname = 'meal_responses_count'
+                ''')
+                if not exists:
+                    await conn.execute('''
+                        INSERT INTO week_headcounts (week_start, day, meal_type, count)
+                        SELECT week_start, day, meal_type, COUNT(*)
+                        FROM meal_responses
+                        WHERE response
+                        GROUP BY week_start, day, meal_type
+                        ON CONFLICT (week_start, day, meal_type) DO UPDATE SET count = excluded.count
+                    ''')
+                    await conn.execute('''
+                        CREATE TRIGGER meal_responses_count
+                        AFTER INSERT OR UPDATE OF response OR DELETE ON meal_responses
+                        FOR EACH ROW EXECUTE FUNCTION meal_responses_count()
+                    ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS scheduler_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    chat_id BIGINT NOT NULL,
+                    text TEXT NOT NULL,
+                    reply_markup TEXT,
+                    dedup_key TEXT UNIQUE,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    sent_at DOUBLE PRECISION,
+                    created_at TIMESTAMPTZ DEFAULT now()
+                )
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbox_due
+                ON outbox (status, next_attempt_at)
+            ''')
+            self.headcounts.update(await conn.fetch('''
+                SELECT week_start, day, meal_type, count FROM week_headcounts
+            '''))
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    @staticmethod
+    def _member_row(row) -> Dict:
+        return {
+            'user_id': row['user_id'],
+            'username': row['username'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'is_active': bool(row['is_active']),
+            'timezone': row['timezone'],
+            'send_time': row['send_time'],
+        }
+
+    async def get_member(self, user_id):
+        row = await self.pool.fetchrow('''
+            SELECT user_id, username, first_name, last_name, is_active, timezone, send_time
+            FROM family_members WHERE user_id = $1
+        ''', user_id)
+        return self._member_row(row) if row else None
+
+    async def add_member(self, user_id, username, first_name, last_name, is_active=False):
+        self.write_version += 1
+        await self.pool.execute('''
+            INSERT INTO family_members (user_id, username, first_name, last_name, is_active)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (user_id) DO NOTHING
+        ''', user_id, username, first_name, last_name, bool(is_active))
+
+    async def set_member_active(self, user_id, is_active):
+        self.write_version += 1
+        return await self.pool.fetchval('''
+            UPDATE family_members SET is_active = $1 WHERE user_id = $2
+            RETURNING first_name
+        ''', bool(is_active), user_id)
+
+    async def set_member_preferences(self, user_id, timezone=None, send_time=None):
+        await self.pool.execute('''
+            UPDATE family_members
+            SET timezone = COALESCE($1, timezone), send_time = COALESCE($2, send_time)
+            WHERE user_id = $3
+        ''', timezone, send_time, user_id)
+
+    async def set_members_active(self, user_ids, is_active):
+        self.write_version += 1
+        rows = await self.pool.fetch('''
+            UPDATE family_members SET is_active = $1 WHERE user_id = ANY($2::bigint[])
+            RETURNING user_id, first_name
+        ''', bool(is_active), list(user_ids))
+        return {row['user_id']: row['first_name'] for row in rows}
+
+    async def list_members(self, is_active=None):
+        if is_active is None:
+            rows = await self.pool.fetch('''
+                SELECT user_id, username, first_name, last_name, is_active, timezone, send_time
+                FROM family_members
+                ORDER BY is_active DESC, first_name
+            ''')
+        else:
+            rows = await self.pool.fetch('''
+                SELECT user_id, username, first_name, last_name, is_active, timezone, send_time
+                FROM family_members WHERE is_active = $1
+                ORDER BY first_name
+            ''', bool(is_active))
+        return [self._member_row(row) for row in rows]
+
+    async def get_first_name(self, user_id):
+        return await self.pool.fetchval('''
+            SELECT first_name FROM family_members WHERE user_id = $1
+        ''', user_id)
+
+    async def get_responses(self, user_id, week_start):
+        rows = await self.pool.fetch('''
+            SELECT day, meal_type, response
+            FROM meal_responses
+            WHERE user_id = $1 AND week_start = $2
+        ''', user_id, week_start)
+        return {(row['day'], row['meal_type']): bool(row['response']) for row in rows}
+
+    @staticmethod
+    async def _read_headcounts(conn, week_start: str, cell: Optional[Cell] = None) -> List[Tuple]:
+        """Read counter rows for a week (or one cell) inside the current write transaction."""
+        if cell:
+            rows = await conn.fetch('''
+                SELECT week_start, day, meal_type, count FROM week_headcounts
+                WHERE week_start = $1 AND day = $2 AND meal_type = $3
+            ''', week_start, *cell)
+        else:
+            rows = await conn.fetch('''
+                SELECT week_start, day, meal_type, count FROM week_headcounts WHERE week_start = $1
+            ''', week_start)
+        return [tuple(row) for row in rows]
+
+    async def toggle_response(self, user_id, week_start, day, meal_type):
+        self.write_version += 1
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                value = await conn.fetchval('''
+                    INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                    VALUES ($1, $2, $3, $4, TRUE)
+                    ON CONFLICT (user_id, week_start, day, meal_type)
+                    DO UPDATE SET response = NOT meal_responses.response, timestamp = now()
+                    RETURNING response
+                ''', user_id, week_start, meal_type, day)
+                # The counter row stays locked until commit, so this is the value after our change
+                counts = await self._read_headcounts(conn, week_start, (day, meal_type))
+        self.headcounts.update(counts)
+        return value
+
+    async def set_response(self, user_id, week_start, day, meal_type, response):
+        self.write_version += 1
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                status = await conn.execute('''
+                    INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (user_id, week_start, day, meal_type)
+                    DO UPDATE SET response = excluded.response, timestamp = now()
+                    WHERE meal_responses.response IS DISTINCT FROM excluded.response
+                ''', user_id, week_start, meal_type, day, bool(response))
+                changed = not status.endswith(' 0')
+                counts = await self._read_headcounts(conn, week_start, (day, meal_type)) if changed else []
+        self.headcounts.update(counts)
+        return changed
+
+    async def set_responses(self, user_id, week_start, cells, response):
+        self.write_version += 1
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany('''
+                    INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (user_id, week_start, day, meal_type)
+                    DO UPDATE SET response = excluded.response, timestamp = now()
+                    WHERE meal_responses.response IS DISTINCT FROM excluded.response
+                ''', [(user_id, week_start, meal_type, day, bool(response)) for day, meal_type in cells])
+                counts = await self._read_headcounts(conn, week_start)
+        self.headcounts.update(counts)
+
+    async def copy_week_responses(self, user_id, from_week, to_week):
+        self.write_version += 1
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('''
+                    DELETE FROM meal_responses WHERE user_id = $1 AND week_start = $2
+                ''', user_id, to_week)
+                await conn.execute('''
+                    INSERT INTO meal_responses (user_id, week_start, meal_type, day, response)
+                    SELECT user_id, $1, meal_type, day, response
+                    FROM meal_responses
+                    WHERE user_id = $2 AND week_start = $3
+                ''', to_week, user_id, from_week)
+                counts = await self._read_headcounts(conn, to_week)
+        self.headcounts.update(counts)
+
+    async def clear_week_responses(self, user_id, week_start):
+        self.write_version += 1
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('''
+                    DELETE FROM meal_responses WHERE user_id = $1 AND week_start = $2
+                ''', user_id, week_start)
+                counts = await self._read_headcounts(conn, week_start)
+        self.headcounts.update(counts)
+
+    async def count_responses(self, user_id, week_start):
+        return await self.pool.fetchval('''
+            SELECT COUNT(*) FROM meal_responses
+            WHERE user_id = $1 AND week_start = $2 AND response
+        ''', user_id, week_start)
+
+    async def week_responses(self, week_start):
+        responses: Dict[int, Dict[Cell, bool]] = {}
+        rows = await self.pool.fetch('''
+            SELECT user_id, day, meal_type, response
+            FROM meal_responses
+            WHERE week_start = $1
+        ''', week_start)
+        for row in rows:
+            responses.setdefault(row['user_id'], {})[(row['day'], row['meal_type'])] = bool(row['response'])
+        return responses
+
+    async def week_headcounts(self, week_start):
+        return self.headcounts.week(week_start)
+
+    async def reconcile_headcounts(self, since_week):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Hold off response writes so the comparison and the repair see the same data
+                await conn.execute('LOCK TABLE meal_responses IN SHARE ROW EXCLUSIVE MODE')
+                actual = {(row[0], row[1], row[2]): row[3] for row in await conn.fetch('''
+                    SELECT week_start, day, meal_type, COUNT(*)
+                    FROM meal_responses
+                    WHERE week_start >= $1 AND response
+                    GROUP BY week_start, day, meal_type
+                ''', since_week)}
+                stored = {(row[0], row[1], row[2]): row[3] for row in await conn.fetch('''
+                    SELECT week_start, day, meal_type, count FROM week_headcounts
+                    WHERE week_start >= $1 AND count != 0
+                ''', since_week)}
+                table_drift = headcount_drift(stored, actual)
+                await conn.executemany('''
+                    INSERT INTO week_headcounts (week_start, day, meal_type, count) VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (week_start, day, meal_type) DO UPDATE SET count = excluded.count
+                ''', [(*key, count) for key, (_, count) in table_drift.items()])
+        drift = {**headcount_drift(self.headcounts.since(since_week), actual), **table_drift}
+        self.headcounts.replace(since_week, actual)
+        if drift:
+            self.write_version += 1
+        return drift
+
+    async def responses_between(self, first_week, last_week):
+        rows = await self.pool.fetch('''
+            SELECT week_start, user_id, day, meal_type, response
+            FROM meal_responses
+            WHERE week_start BETWEEN $1 AND $2
+        ''', first_week, last_week)
+        return [tuple(row) for row in rows]
+
+    async def report_snapshot(self, week_start):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                members = await conn.fetch('''
+                    SELECT user_id, username, first_name, last_name, is_active, timezone, send_time
+                    FROM family_members WHERE is_active
+                    ORDER BY first_name
+                ''')
+                rows = await conn.fetch('''
+                    SELECT user_id, day, meal_type, response
+                    FROM meal_responses
+                    WHERE week_start = $1
+                ''', week_start)
+        responses: Dict[int, Dict[Cell, bool]] = {}
+        headcounts: Dict[Cell, int] = {}
+        for row in rows:
+            cell = (row['day'], row['meal_type'])
+            responses.setdefault(row['user_id'], {})[cell] = bool(row['response'])
+            if row['response']:
+                headcounts[cell] = headcounts.get(cell, 0) + 1
+        return {
+            'members': [self._member_row(row) for row in members],
+            'responses': responses,
+            'headcounts': headcounts,
+        }
+
+    async def probe(self):
+        await self.pool.fetchval('SELECT 1')
+
+    async def get_state(self, key, default=None):
+        value = await self.pool.fetchval('''
+            SELECT value FROM scheduler_state WHERE key = $1
+        ''', key)
+        return default if value is None else value
+
+    async def set_state(self, key, value):
+        await self.pool.execute('''
+            INSERT INTO scheduler_state (key, value) VALUES ($1, $2)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        ''', key, value)
+
+    async def enqueue_outbox(self, chat_id, text, reply_markup=None, dedup_key=None, not_before=0.0):
+        status = await self.pool.execute('''
+            INSERT INTO outbox (chat_id, text, reply_markup, dedup_key, next_attempt_at)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (dedup_key) DO NOTHING
+        ''', chat_id, text, reply_markup, dedup_key, not_before)
+        return not status.endswith(' 0')
+
+    async def enqueue_outbox_many(self, messages):
+        queued = 0
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for message in messages:
+                    status = await conn.execute('''
+                        INSERT INTO outbox (chat_id, text, reply_markup, dedup_key, next_attempt_at)
+                        VALUES ($1, $2, $3, $4, $5)
+                        ON CONFLICT (dedup_key) DO NOTHING
+                    ''', message['chat_id'], message['text'], message.get('reply_markup'),
+                        message.get('dedup_key'), message.get('not_before', 0.0))
+                    queued += not status.endswith(' 0')
+        return queued
+
+    async def due_outbox(self, now, limit):
+        rows = await self.pool.fetch('''
+            SELECT id, chat_id, text, reply_markup, dedup_key, attempts, next_attempt_at
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= $1
+            ORDER BY next_attempt_at, id
+            LIMIT $2
+        ''', now, limit)
+        return [dict(row) for row in rows]
+
+    async def mark_outbox_sent(self, message_id, sent_at):
+        await self.pool.execute('''
+            UPDATE outbox SET status = 'sent', sent_at = $1 WHERE id = $2
+        ''', sent_at, message_id)
+
+    async def retry_outbox(self, message_id, attempts, next_attempt_at, error):
+        await self.pool.execute('''
+            UPDATE outbox SET attempts = $1, next_attempt_at = $2, last_error = $3 WHERE id = $4
+        ''', attempts, next_attempt_at, error, message_id)
+
+    async def dead_letter_outbox(self, message_id, attempts, error):
+        await self.pool.execute('''
+            UPDATE outbox SET status = 'dead', attempts = $1, last_error = $2 WHERE id = $3
+        ''', attempts, error, message_id)
+
+    async def outbox_depth(self):
+        return await self.pool.fetchval('''
+            SELECT COUNT(*) FROM outbox WHERE status = 'pending'
+        ''')
+
+    async def prune_outbox(self, sent_before):
+        status = await self.pool.execute('''
+            DELETE FROM outbox WHERE status = 'sent' AND sent_at < $1
+        ''', sent_before)
+        return int(status.split()[-1])
+
+
+def create_storage(backend: Optional[str] = None) -> StorageBackend:
+    """Build the storage backend named by STORAGE_BACKEND (sqlite, memory or postgres)."""
+    backend = (backend or os.getenv('STORAGE_BACKEND', 'sqlite')).lower()
+
+    if backend == 'sqlite':
+        return SQLiteStorage(os.getenv('DATABASE_PATH', DEFAULT_DATABASE_PATH))
+    if backend == 'memory':
+        return InMemoryStorage()
+    if backend == 'postgres':
+        dsn = os.getenv('DATABASE_URL')
+        if not dsn:
+            raise ValueError("DATABASE_URL not found in environment variables")
+        return PostgresStorage(dsn, max_size=int(os.getenv('DATABASE_POOL_SIZE', 10)))
+
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,209 @@
+"""
+Compact in-memory survey state.
+
+A week's survey is 21 yes/no cells (7 days x 3 meals), so one member-week
+fits in two small integers: a mask of answered cells and a mask of selected
+cells. Members get a fixed slot number, and each week keeps both masks in
+arrays indexed by slot, so a member-week costs 8 bytes instead of a dict
+with 21 tuple keys (roughly 1-2 KB). Member details use __slots__ records
+instead of per-member dicts.
+
+Each week also keeps a live headcount per cell, adjusted on every change,
+so reading a week's headcounts doesn't scan its members.
+"""
+
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# A single survey cell, e.g. ('Monday', 'breakfast')
+Cell = Tuple[str, str]
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner']
+
+
+class MemberRecord:
+    """Family member details without a per-instance __dict__."""
+
+    __slots__ = ('user_id', 'username', 'first_name', 'last_name', 'is_active', 'timezone', 'send_time')
+
+    def __init__(self, user_id: int, username: Optional[str], first_name: Optional[str],
+                 last_name: Optional[str], is_active: bool = False,
+                 timezone: Optional[str] = None, send_time: Optional[str] = None):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.is_active = is_active
+        self.timezone = timezone
+        self.send_time = send_time
+
+    def as_dict(self) -> Dict:
+        """Return the member in the dict shape used by the storage interface."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SurveyGrid:
+    """Maps (day, meal_type) cells to bit positions."""
+
+    def __init__(self, days: List[str] = DAYS, meal_types: List[str] = MEAL_TYPES):
+        self.cells: List[Cell] = [(day, meal_type) for day in days for meal_type in meal_types]
+        self.bits: Dict[Cell, int] = {cell: 1 << index for index, cell in enumerate(self.cells)}
+        # Smallest array type that holds a whole week's mask
+        self.typecode = next(code for code in 'IQ' if array(code).itemsize * 8 >= len(self.cells))
+
+    def bit(self, cell: Cell) -> int:
+        try:
+            return self.bits[cell]
+        except KeyError:
+            raise ValueError(f"Unknown survey cell: {cell}") from None
+
+    def mask(self, cells) -> int:
+        mask = 0
+        for cell in cells:
+            mask |= self.bit(cell)
+        return mask
+
+    def decode(self, answered: int, selected: int) -> Dict[Cell, bool]:
+        """Expand masks into the {(day, meal_type): bool} dict used by the storage interface."""
+        return {cell: bool(selected & bit) for cell, bit in self.bits.items() if answered & bit}
+
+
+class WeekSelections:
+    """Answered and selected masks for one week, indexed by member slot, plus headcounts per cell."""
+
+    __slots__ = ('answered', 'selected', 'counts')
+
+    def __init__(self, typecode: str, size: int = 0, cells: int = 0):
+        self.answered = array(typecode, bytes(array(typecode).itemsize * size))
+        self.selected = array(typecode, bytes(array(typecode).itemsize * size))
+        self.counts = array('I', bytes(array('I').itemsize * cells))
+
+    def recount(self, before: int, after: int):
+        """Adjust headcounts for one member's selected mask changing from before to after."""
+        changed = before ^ after
+        index = 0
+        while changed:
+            if changed & 1:
+                self.counts[index] += 1 if after >> index & 1 else -1
+            changed >>= 1
+            index += 1
+
+    def ensure(self, slot: int):
+        missing = slot + 1 - len(self.answered)
+        if missing > 0:
+            self.answered.extend([0] * missing)
+            self.selected.extend([0] * missing)
+
+
+class SurveyState:
+    """Member records plus weekly selections in arrays indexed by member slot."""
+
+    def __init__(self, grid: Optional[SurveyGrid] = None):
+        self.grid = grid or SurveyGrid()
+        self.members: Dict[int, MemberRecord] = {}
+        self.slots: Dict[int, int] = {}
+        self.slot_users = array('q')
+        self.weeks: Dict[str, WeekSelections] = {}
+
+    def _slot(self, user_id: int) -> int:
+        slot = self.slots.get(user_id)
+        if slot is None:
+            slot = self.slots[user_id] = len(self.slot_users)
+            self.slot_users.append(user_id)
+        return slot
+
+    def _week(self, week_start: str, slot: int) -> WeekSelections:
+        week = self.weeks.get(week_start)
+        if week is None:
+            week = self.weeks[week_start] = WeekSelections(self.grid.typecode, len(self.slot_users),
+                                                           len(self.grid.cells))
+        week.ensure(slot)
+        return week
+
+    # Members
+
+    def add_member(self, record: MemberRecord):
+        """Add or replace a member record and give it a selection slot."""
+        self.members[record.user_id] = record
+        self._slot(record.user_id)
+
+    # Selections
+
+    def masks(self, user_id: int, week_start: str) -> Tuple[int, int]:
+        """Return the (answered, selected) masks for a member-week."""
+        slot = self.slots.get(user_id)
+        week = self.weeks.get(week_start)
+        if slot is None or week is None or slot >= len(week.answered):
+            return 0, 0
+        return week.answered[slot], week.selected[slot]
+
+    def get(self, user_id: int, week_start: str) -> Dict[Cell, bool]:
+        return self.grid.decode(*self.masks(user_id, week_start))
+
+    def count(self, user_id: int, week_start: str) -> int:
+        """Return how many meals a member selected for a week."""
+        return self.masks(user_id, week_start)[1].bit_count()
+
+    def set(self, user_id: int, week_start: str, cells, value: bool) -> bool:
+        """Set cells to a value; returns True if anything changed."""
+        slot = self._slot(user_id)
+        week = self._week(week_start, slot)
+        mask = self.grid.mask(cells)
+        answered = week.answered[slot] | mask
+        selected = week.selected[slot] | mask if value else week.selected[slot] & ~mask
+        changed = (answered, selected) != (week.answered[slot], week.selected[slot])
+        week.recount(week.selected[slot], selected)
+        week.answered[slot] = answered
+        week.selected[slot] = selected
+        return changed
+
+    def toggle(self, user_id: int, week_start: str, cell: Cell) -> bool:
+        """Flip a cell and return its new value."""
+        slot = self._slot(user_id)
+        week = self._week(week_start, slot)
+        bit = self.grid.bit(cell)
+        week.answered[slot] |= bit
+        week.recount(week.selected[slot], week.selected[slot] ^ bit)
+        week.selected[slot] ^= bit
+        return bool(week.selected[slot] & bit)
+
+    def copy(self, user_id: int, from_week: str, to_week: str):
+        """Replace a member's week with a copy of another week."""
+        answered, selected = self.masks(user_id, from_week)
+        slot = self._slot(user_id)
+        week = self._week(to_week, slot)
+        week.recount(week.selected[slot], selected)
+        week.answered[slot] = answered
+        week.selected[slot] = selected
+
+    def clear(self, user_id: int, week_start: str):
+        """Forget all of a member's answers for a week."""
+        slot = self._slot(user_id)
+        week = self._week(week_start, slot)
+        week.recount(week.selected[slot], 0)
+        week.answered[slot] = 0
+        week.selected[slot] = 0
+
+    def week_members(self, week_start: str) -> Iterator[Tuple[int, int, int]]:
+        """Yield (user_id, answered, selected) for members who answered anything that week."""
+        week = self.weeks.get(week_start)
+        if week is None:
+            return
+        for slot, answered in enumerate(week.answered):
+            if answered:
+                yield self.slot_users[slot], answered, week.selected[slot]
+
+    def headcounts(self, week_start: str) -> Dict[Cell, int]:
+        """Return the live selection count per cell for a week."""
+        week = self.weeks.get(week_start)
+        if week is None:
+            return {}
+        return {cell: count for cell, count in zip(self.grid.cells, week.counts) if count}
+
+    def count_selected(self, week_start: str) -> List[int]:
+        """Recount selections per cell from the members' masks, in grid order."""
+        week = self.weeks.get(week_start)
+        if week is None:
+            return [0] * len(self.grid.cells)
+        return [sum(1 for selected in week.selected if selected & bit) for bit in self.grid.bits.values()]
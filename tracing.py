@@ -0,0 +1,311 @@
+"""
+Lightweight span tracing for MealsBot.
+
+Every incoming update is processed inside a trace. Repository calls and
+outbound Bot API requests made while handling it are recorded as child
+spans, so a slow button tap can be broken down into database time, markup
+rendering and Telegram round trips.
+
+When TRACING_ENABLED is set, finished traces are exported as OTLP/JSON (one
+ResourceSpans document per line) to a rotating file in TRACE_DIR, written by
+a background thread. Traces slower than SLOW_TRACE_MS are always exported
+and also logged as a warning with a per-span breakdown; other traces are
+kept at TRACE_SAMPLE_RATE.
+"""
+
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from log_setup import DeferredQueueHandler
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('mealsbot_current_span', default=None)
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'status_message')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: str, kind: int, attributes: Dict):
+        self.trace = trace
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.status = STATUS_OK
+        self.status_message = ''
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """All spans recorded while handling one unit of work."""
+
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self):
+        self.trace_id = '%032x' % random.getrandbits(128)
+        self.spans: List[Span] = []
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_span(span: Span) -> Dict:
+    return {
+        'traceId': span.trace.trace_id,
+        'spanId': span.span_id,
+        'parentSpanId': span.parent_id,
+        'name': span.name,
+        'kind': span.kind,
+        'startTimeUnixNano': str(span.start_ns),
+        'endTimeUnixNano': str(span.end_ns),
+        'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in span.attributes.items()],
+        'status': {'code': span.status, 'message': span.status_message},
+    }
+
+
+class _JsonLine:
+    """Defer JSON encoding of an exported trace to the writer thread."""
+
+    __slots__ = ('document',)
+
+    def __init__(self, document: Dict):
+        self.document = document
+
+    def __str__(self):
+        return json.dumps(self.document, default=str, ensure_ascii=False)
+
+
+class FileSpanExporter:
+    """Write finished traces as OTLP/JSON lines to a rotating file off the event loop."""
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 service_name: str = 'mealsbot'):
+        self.resource = {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]}
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+        trace_queue = queue.SimpleQueue()
+        self._logger = logging.getLogger('mealsbot.traces')
+        self._logger.handlers[:] = [DeferredQueueHandler(trace_queue)]
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+
+        self._listener = logging.handlers.QueueListener(trace_queue, file_handler)
+        self._listener.start()
+
+    def export(self, trace: Trace):
+        self._logger.info(_JsonLine({'resourceSpans': [{
+            'resource': self.resource,
+            'scopeSpans': [{
+                'scope': {'name': 'mealsbot'},
+                'spans': [_otlp_span(span) for span in trace.spans],
+            }],
+        }]}))
+
+    def shutdown(self):
+        self._listener.stop()
+
+
+class Tracer:
+    """Create traces and spans; disabled when no exporter is configured."""
+
+    def __init__(self, exporter: Optional[FileSpanExporter] = None, slow_threshold_ms: float = 1000.0,
+                 sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.slow_threshold_ms = slow_threshold_ms
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextmanager
+    def trace(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        """Start a new trace with a root span for the duration of the block."""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace()
+        root = Span(trace, name, '', kind, attributes)
+        try:
+            with self._activate(root):
+                yield root
+        finally:
+            self._finish(trace, root)
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        """Record a child span of the current span; a no-op outside a trace."""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        with self._activate(Span(parent.trace, name, parent.span_id, kind, attributes)) as span:
+            yield span
+
+    @contextmanager
+    def _activate(self, span: Span):
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            span.trace.spans.append(span)
+            _current_span.reset(token)
+
+    def _finish(self, trace: Trace, root: Span):
+        slow = root.duration_ms >= self.slow_threshold_ms
+        if slow:
+            root.set_attribute('mealsbot.slow', True)
+            breakdown = sorted(trace.spans, key=lambda s: s.start_ns)
+            logger.warning(
+                "Slow trace %s (%s) took %.0f ms", trace.trace_id, root.name, root.duration_ms,
+                extra={'event': 'slow_trace', 'trace_id': trace.trace_id, 'duration_ms': round(root.duration_ms, 1),
+                       'spans': [f"{span.name} {span.duration_ms:.1f}ms" for span in breakdown]}
+            )
+        if slow or self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            self.exporter.export(trace)
+
+    def shutdown(self):
+        if self.exporter:
+            self.exporter.shutdown()
+
+
+class TracedStorage:
+    """Proxy for a storage backend that records a span around every coroutine method."""
+
+    def __init__(self, storage, tracer: Tracer):
+        self._storage = storage
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        tracer = self._tracer
+        attributes = {'db.system': self._storage.name, 'db.operation': name}
+
+        async def traced(*args, **kwargs):
+            with tracer.span(f"storage.{name}", SPAN_KIND_CLIENT, **attributes):
+                return await attr(*args, **kwargs)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, traced)
+        return traced
+
+
+class TracedRequest(HTTPXRequest):
+    """Bot API request backend that records a span around every outbound call."""
+
+    def __init__(self, tracer: Tracer, **kwargs):
+        super().__init__(**kwargs)
+        self._tracer = tracer
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        # The URL embeds the bot token, so only its last segment is recorded
+        endpoint = url.rsplit('/', 1)[-1]
+        with self._tracer.span(f"bot_api.{endpoint}", SPAN_KIND_CLIENT,
+                               **{'http.method': method, 'telegram.method': endpoint}) as span:
+            status_code, payload = await super().do_request(url, method, *args, **kwargs)
+            if span:
+                span.set_attribute('http.status_code', status_code)
+            return status_code, payload
+
+
+class TracedApplication(Application):
+    """Application that processes every update inside its own trace."""
+
+    def __init__(self, *, tracer: Tracer, **kwargs):
+        super().__init__(**kwargs)
+        self.tracer = tracer
+
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            await super().process_update(update)
+            return
+
+        attributes = {'telegram.update_id': update.update_id}
+        if update.effective_user:
+            attributes['telegram.user_id'] = update.effective_user.id
+        if update.callback_query:
+            name = 'update.callback_query'
+            attributes['telegram.callback_data'] = update.callback_query.data or ''
+        elif update.effective_message and update.effective_message.text:
+            name = 'update.message'
+            attributes['telegram.command'] = update.effective_message.text.split(maxsplit=1)[0]
+        else:
+            name = 'update'
+
+        with self.tracer.trace(name, SPAN_KIND_SERVER, **attributes):
+            await super().process_update(update)
+
+
+def create_tracer() -> Tracer:
+    """Create a tracer from TRACING_ENABLED, TRACE_DIR, TRACE_FILE and related settings."""
+    if os.getenv('TRACING_ENABLED', 'false').lower() not in ('1', 'true', 'yes', 'on'):
+        return Tracer()
+    directory = os.getenv('TRACE_DIR', 'traces')
+    os.makedirs(directory, exist_ok=True)
+    exporter = FileSpanExporter(
+        os.path.join(directory, os.getenv('TRACE_FILE', 'traces.jsonl')),
+        max_bytes=int(os.getenv('TRACE_MAX_BYTES', 10 * 1024 * 1024)),
+        backup_count=int(os.getenv('TRACE_BACKUP_COUNT', 5)),
+    )
+    return Tracer(
+        exporter,
+        slow_threshold_ms=float(os.getenv('SLOW_TRACE_MS', 1000)),
+        sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 0.05)),
+    )
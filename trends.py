@@ -0,0 +1,94 @@
+"""
+Multi-week headcount trends and forecasts.
+
+Responses over a range of weeks are loaded in one query and scattered into
+a boolean weeks x members x days x meals cube. Headcounts, rolling
+averages, attendance rates and the next-week forecast are then whole-array
+reductions over that cube, so a report over years of history costs a few
+milliseconds once the rows are loaded.
+"""
+
+from datetime import date, timedelta
+from itertools import repeat
+from operator import itemgetter
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from survey_state import DAYS, MEAL_TYPES
+
+# (week_start, user_id, day, meal_type, response), as returned by storage.responses_between
+ResponseRow = Tuple[str, int, str, str, bool]
+
+
+def week_range(first_week: str, last_week: str) -> List[str]:
+    """Every week start from first_week to last_week inclusive."""
+    first = date.fromisoformat(first_week)
+    count = (date.fromisoformat(last_week) - first).days // 7 + 1
+    return [(first + timedelta(weeks=index)).isoformat() for index in range(max(count, 0))]
+
+
+def _codes(rows: List[ResponseRow], column: int, labels: Sequence) -> np.ndarray:
+    """Index of each row's value in labels, or -1 if it is not there."""
+    # map() keeps the per-row lookups in C; this is the slow part for years of rows
+    index = {label: position for position, label in enumerate(labels)}
+    values = map(itemgetter(column), rows)
+    return np.fromiter(map(index.get, values, repeat(-1)), dtype=np.intp, count=len(rows))
+
+
+class HeadcountCube:
+    """Answered and selected meals as boolean weeks x members x days x meals arrays."""
+
+    def __init__(self, weeks: List[str], member_ids: List[int], answered: np.ndarray, selected: np.ndarray,
+                 days: List[str] = DAYS, meal_types: List[str] = MEAL_TYPES):
+        self.weeks = weeks
+        self.member_ids = member_ids
+        self.answered = answered
+        self.selected = selected
+        self.days = days
+        self.meal_types = meal_types
+
+    @classmethod
+    def from_rows(cls, weeks: List[str], member_ids: List[int], rows: List[ResponseRow],
+                  days: List[str] = DAYS, meal_types: List[str] = MEAL_TYPES) -> 'HeadcountCube':
+        """Scatter response rows into the cube; rows outside the weeks or members are ignored."""
+        shape = (len(weeks), len(member_ids), len(days), len(meal_types))
+        answered = np.zeros(shape, dtype=bool)
+        selected = np.zeros(shape, dtype=bool)
+        if rows:
+            codes = [_codes(rows, column, labels)
+                     for column, labels in enumerate((weeks, member_ids, days, meal_types))]
+            response = np.fromiter(map(itemgetter(4), rows), dtype=bool, count=len(rows))
+            keep = np.logical_and.reduce([code >= 0 for code in codes])
+            index = tuple(code[keep] for code in codes)
+            answered[index] = True
+            selected[index] = response[keep]
+        return cls(weeks, member_ids, answered, selected, days, meal_types)
+
+    def headcounts(self) -> np.ndarray:
+        """Selected meals per week, day and meal: shape (weeks, days, meals)."""
+        return self.selected.sum(axis=1, dtype=np.int32)
+
+    def rolling_mean(self, window: int) -> np.ndarray:
+        """Mean headcount over each run of `window` weeks: shape (weeks - window + 1, days, meals)."""
+        window = max(1, min(window, len(self.weeks)))
+        totals = np.cumsum(self.headcounts(), axis=0, dtype=np.float64)
+        totals = np.concatenate([np.zeros((1,) + totals.shape[1:]), totals])
+        return (totals[window:] - totals[:-window]) / window
+
+    def attendance(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Per member, the weeks answered and the share of meals selected in those weeks."""
+        weeks_answered = self.answered.any(axis=(2, 3)).sum(axis=0)
+        meals = self.selected.sum(axis=(0, 2, 3))
+        possible = weeks_answered * len(self.days) * len(self.meal_types)
+        rates = np.divide(meals, possible, out=np.zeros(len(self.member_ids)), where=possible > 0)
+        return weeks_answered, rates
+
+    def forecast(self, window: int = 8, smoothing: float = 0.5) -> np.ndarray:
+        """Next week's headcount per day and meal as an exponentially weighted mean of recent weeks."""
+        recent = self.headcounts()[-window:]
+        if not len(recent):
+            return np.zeros((len(self.days), len(self.meal_types)))
+        # Most recent week gets the largest weight
+        weights = smoothing * (1 - smoothing) ** np.arange(len(recent))[::-1]
+        return np.tensordot(weights / weights.sum(), recent, axes=1)